@@ -17,6 +17,8 @@ homePath='/home/mutrosa/Documents/projects/localizer_fMRI'
 ## b.) Extracts motion outliers from fMRIprep derivatives.
 echo "STEP 1: Filtering artifacts ..."
 python -m scripts.analysis.artifacts "$subID" "$sesID" "$homePath"
+# To regenerate the artifacts of all subjects and sessions in parallel, run instead:
+# python -m scripts.analysis.artifacts "$homePath"
 echo "Completed STEP 1 ;)"
 
 # # STEP 2: Design
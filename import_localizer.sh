@@ -19,6 +19,10 @@ homePath='/home/mutrosa/Documents/projects/localizer_fMRI'
 ## Generate sidecar files to set up the configuration files.
 ## Run script pre_import.py in the terminal.
 
+# To import several subjects/sessions at once, run the steps below concurrently
+# (stages already completed are skipped; logs are saved in $homePath/logs/import):
+# python -m scripts.import.scheduler "$project" "$task" "$homePath" 4 3:1 3:2 4:1 4:2
+
 # STEP 1: MRI
 ## a.) BIDSifies sourcedata (dicoms).
 ## b.) Removes background noise from MP2RAGE UNI images (T1w).
@@ -33,9 +37,9 @@ python -m scripts.import.import_LOG "$subID" "$sesID" "$project" "$homePath"
 echo "Completed STEP 2 ;)"
 
 # STEP 3: BIOPAC
-## a.) Converts sourcedata (.acq) into TAPAS-compatible data (.mat or .txt).
-## b.) Preprocesses the compatible data.
-## c.) Calculates regressors.
+## a.) Converts sourcedata (.acq) into a binary store (.h5).
+## b.) Splits the recordings into runs using the scanner triggers.
+## c.) Calculates regressors (RETROICOR; add "tapas" as the last argument to use TAPAS PhysIO instead).
 echo "STEP 3: Starting PHYSIO import..."
 python -m scripts.import.import_PHYSIO "$subID" "$sesID" "$project" "$task" "$homePath"
 echo "Completed STEP 3 ;)"
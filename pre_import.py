@@ -1,20 +1,29 @@
-import bioread, glob, os, shutil
+import bioread, glob, importlib, os, shutil
 
 # Ensure that you have all the BIDS-compliant folders. Run this command only once.
 os.system("dcm2bids_scaffold")
 
 # 1. Adjust parameters for your subject/session
 # Activate the correct conda environment: conda activate dcm2bids
-subID    = 2
-sesID    = 2
-project  = "SubCort_HighRes"
-homePath = '/home/mutrosa/Documents/projects/select_fMRI/data_MRI/'
+subID      = 2
+sesID      = 2
+project    = "SubCort_HighRes"
+homePath   = '/home/mutrosa/Documents/projects/select_fMRI/data_MRI/'
+dicomFold  = f"{homePath}sourcedata/dicoms/sub-{subID:02d}_ses-{sesID:02d}_{project}"
+run_helper = False # set to True to convert the session with dcm2bids_helper (step 3)
 
-# 2. Generate sidecar files.
-# These are needed for setting up the conf.json and checking the completeness of data.
-# DICOM directory(ies) or archive(s)
-helper_command =  f"dcm2bids_helper -d {homePath}sourcedata/dicoms/sub-{subID:02d}_ses-{sesID:02d}_{project} "
+# 2. Check the completeness of the data without converting it (DICOM headers only).
+# Optionally, give the expected number of volumes per SeriesDescription, e.g. {"<SeriesDescription>": 200}.
+# The inventory is cached in derivatives/dicom_inventory, so later checks only read new or changed series.
+dicom_inventory = importlib.import_module("scripts.import.dicom_inventory")
+dicom_inventory.check_session(dicomFold, expected = {}, cache_dir = f"{homePath}derivatives/dicom_inventory")
 
-# Output directory
-helper_command += f"-o {homePath}sidecars/sub-{subID:02d}/ses-{sesID:02d}"
-os.system(helper_command)
\ No newline at end of file
+# 3. Generate sidecar files (converts the whole session; only if run_helper is True).
+# These are needed for setting up the conf.json.
+if run_helper:
+	# DICOM directory(ies) or archive(s)
+	helper_command =  f"dcm2bids_helper -d {dicomFold} "
+
+	# Output directory
+	helper_command += f"-o {homePath}sidecars/sub-{subID:02d}/ses-{sesID:02d}"
+	os.system(helper_command)
@@ -2,15 +2,20 @@
 # Time-stamp: <2025-04-09 m.utrosa@bcbl.eu>
 
 # Import python packages
-from nipype import Node, Workflow, IdentityInterface, Function
+import pandas as pd
+from nipype import Node, MapNode, Workflow, IdentityInterface, Function
 import nipype.algorithms.modelgen as model
-from nipype.interfaces import freesurfer, spm, ants
+from nipype.interfaces import spm, ants
+from nipype.interfaces.matlab import MatlabCommand
 from nipype.interfaces.io import DataSink
 
 # Import custom-made functions (scripts)
 import grabber
-from objects_v02 import grab_objects
+from objects_v02 import grab_objects, build_manifest, OUTPUT_NAMES
 from designs_v02 import localizer
+from glm import glm_node
+from compression import gunzip_nifti, gzip_nifti
+import result_cache
 
 # -------------------------------------------------------------------------------------------------
 # 00. Experiment Parameters
@@ -36,10 +41,58 @@ acqID_list = ["ME3TR1600", "ME3TR1100", "ME3TR850", "ME3TR700", "DresdenNoFat175
 homePath   = '/home/mutrosa/Documents/projects/localizer_fMRI'
 tmp_dir    = homePath + '/scripts/analysis/tmp'
 out_dir    = homePath + "/results"
+nii_cache  = homePath + "/scripts/analysis/nii_cache" # decompressed BOLD, kept across workflow reruns
+res_cache  = homePath + "/results/cache"             # first-level results, keyed by input content
 hrf_dervs  = [0, 0] # using the canonical hrf (without derivatives)
 volterra   = False
 contrasts  = [('localizer', 'T', ['sound', 'silence'], [1, -1])]
 MNI        = homePath + "/templates/tpl-MNI152NLin2009cAsym_res-01_T1w.nii.gz" # the same as in fMRIprep !
+high_pass  = 128
+warp_maps  = True  # False: skip warper/zipper and sample the ROIs in native space (see roi_sampling.py)
+backend    = "spm" # "spm" (MATLAB) or "numpy" (in-process GLM, see glm.py; canonical hrf only)
+
+# Execution: "Linear" runs one node at a time, "MultiProc" runs nodes of all iterables in parallel
+# within the worker budget (n_procs CPUs, memory_gb of RAM).
+plugin     = "MultiProc"
+n_procs    = 32
+memory_gb  = 120
+
+# Estimated resources per node, used by MultiProc to avoid oversubscribing RAM and CPUs.
+resources  = {'unzip'     : {'mem_gb': 2,   'n_procs': 1},
+			  'modeler'   : {'mem_gb': 0.5, 'n_procs': 1},
+			  'designer'  : {'mem_gb': 0.5, 'n_procs': 1},
+			  'estimator' : {'mem_gb': 8,   'n_procs': 1},
+			  'contrastor': {'mem_gb': 2,   'n_procs': 1},
+			  'glmer'     : {'mem_gb': 4,   'n_procs': 1},
+			  'warper'    : {'mem_gb': 4,   'n_procs': 2},
+			  'zipper'    : {'mem_gb': 2,   'n_procs': 1}}
+
+# The NumPy GLM only implements the canonical hrf without derivatives or Volterra expansion.
+if backend == "numpy" and (list(hrf_dervs) != [0, 0] or volterra):
+	raise ValueError(f"backend = 'numpy' supports hrf_dervs = [0, 0] and volterra = False only "
+					 f"(got hrf_dervs = {hrf_dervs}, volterra = {volterra}); use backend = 'spm'.")
+
+# MATLAB is multithreaded by default: keep each SPM node on the single CPU it was given.
+if plugin == "MultiProc":
+	MatlabCommand.set_default_matlab_cmd("matlab -nodesktop -nosplash -singleCompThread")
+
+# Resolve the inputs of all iterables once (see objects_v02.build_manifest).
+manifest   = build_manifest(sub_list, ses_list, acqID_list, homePath, tmp_dir + "/manifest.tsv")
+
+# Acquisitions with unchanged inputs and model are restored from the result cache, not re-estimated.
+model_params = {'hrf_dervs': hrf_dervs, 'volterra': volterra, 'high_pass': high_pass,
+				'contrasts': contrasts, 'backend': backend, 'warp_maps': warp_maps}
+# Only the (subject, session, acquisition) combinations that missed the cache are run.
+to_cache = []
+for row in pd.read_csv(manifest, sep = '\t').to_dict('records'):
+	key        = result_cache.result_key(row, model_params, res_cache)
+	result_dir = out_dir + '/1stLevel/sub-0%s/ses-0%s/acq-%s' % (row['subID'], row['sesID'], row['acqID'])
+	if result_cache.restore(key, res_cache, result_dir):
+		print(f"Restored acq-{row['acqID']} (sub-{row['subID']:02d}, ses-{row['sesID']:02d}) from the result cache.")
+	else:
+		result_cache.clear(result_dir) # drop results of an earlier model before this run
+		to_cache.append((key, result_dir, (int(row['subID']), int(row['sesID']), row['acqID'])))
+runs = [run for _, _, run in to_cache]
 
 # -------------------------------------------------------------------------------------------------
 # 01. Specify Nodes
@@ -48,9 +101,10 @@ MNI        = homePath + "/templates/tpl-MNI152NLin2009cAsym_res-01_T1w.nii.gz" #
 # The Identity Interface allows to create Nodes that only work with strings (parameters)!
 infosource = Node(IdentityInterface(fields = ['subID', 'sesID', 'acqID']),
 				  name = "infosource")
-infosource.iterables = [('subID', sub_list),
-						('sesID', ses_list),
-						('acqID', acqID_list)]
+infosource.iterables = [('subID', [sub for sub, _, _ in runs]),
+						('sesID', [ses for _, ses, _ in runs]),
+						('acqID', [acq for _, _, acq in runs])]
+infosource.synchronize = True # iterate over the listed combinations, not their product
 
 # Datasink: create output folder for important outputs
 datasink = Node(DataSink(base_directory = tmp_dir,
@@ -61,18 +115,18 @@ datasink = Node(DataSink(base_directory = tmp_dir,
 substitutions = []
 subjFolders = [('_acqID_%s_sesID_%s_subID_%s' % (acq, ses, sub),
 				'sub-0%s/ses-0%s/acq-%s' % (sub, ses, acq))
-               for acq in acqID_list
-               for ses in ses_list
-               for sub in sub_list]
+               for sub, ses, acq in runs]
 substitutions.extend(subjFolders)
 datasink.inputs.substitutions = substitutions
 
 # Define a Node that extracts filepaths for all files required for the analysis.
-infohandle = Node(Function(input_names  = ["subID", "sesID", "acqID", "homePath"],
-						   output_names = ["log_path", "bold_path", "mask_path", "conf_path", "out_path", "T1w_path", "T1w_toMNI_path", "fsNative_toT1w_path", "TR"], 
+# The paths of all iterables are resolved once into a manifest, which the node only looks up.
+infohandle = Node(Function(input_names  = ["subID", "sesID", "acqID", "homePath", "manifest"],
+						   output_names = OUTPUT_NAMES,
 						   function = grab_objects),
 				name = "infohandle")
 infohandle.inputs.homePath = homePath
+infohandle.inputs.manifest = manifest
 
 # Extract information needed to specify a model in the form of a Bunch object.
 # Provide info for the Bunch through parsing the event files.
@@ -82,40 +136,60 @@ design_bunch = Node(Function(input_names  = ["logfilepath"],
 					name = "design_bunch")
 
 # Unzip funcional image (preprocessed BOLD).
-unzip = Node(freesurfer.MRIConvert(out_type = 'nii'),
-			 name = 'unzip')
+unzip = Node(Function(input_names  = ["in_file", "cache_dir"],
+					  output_names = ["out_file"],
+					  function = gunzip_nifti),
+			 name = 'unzip', **resources['unzip'])
+unzip.inputs.cache_dir = nii_cache
 
 # SpecifyModel: generate SPM-specific godel.
 modeler = Node(model.SpecifySPMModel(concatenate_runs = False,
 									 input_units  = 'secs',
 									 output_units = 'secs',
-									 high_pass_filter_cutoff = 128),
-			   name = 'modeler')
+									 high_pass_filter_cutoff = high_pass),
+			   name = 'modeler', **resources['modeler'])
 
 # Level1Design: generate an SPM design matrix.
 designer = Node(spm.Level1Design(bases = {'hrf': {'derivs': hrf_dervs}},
 								 timing_units = 'secs',
 								 volterra_expansion_order = (2 if volterra else 1)),
-				name = 'designer')
+				name = 'designer', **resources['designer'])
 
 # Estimate Model: estimate the parameters of the model.
 estimator = Node(spm.EstimateModel(estimation_method = {'Classical': 1}),
-				 name = 'estimator')
+				 name = 'estimator', **resources['estimator'])
 
 # Contrast Estimation
 contrastor = Node(spm.EstimateContrast(contrasts = contrasts),
-				  name = 'contrastor')
+				  name = 'contrastor', **resources['contrastor'])
+
+# NumPy alternative to modeler -> designer -> estimator -> contrastor.
+glmer = Node(Function(input_names  = ["bold_path", "mask_path", "design_info", "TR", "conf_path", "out_path",
+									  "contrasts", "high_pass"],
+					  output_names = ["beta_images", "con_images", "spmT_images"],
+					  function = glm_node),
+			 name = 'glmer', **resources['glmer'])
+glmer.inputs.contrasts = contrasts
+glmer.inputs.high_pass = high_pass
 
-# Move data from T1 to MNI space with ANTS.
-warper = Node(ants.ApplyTransforms(reference_image = MNI,
-								   dimension = 3,
-								   interpolation = 'Linear',
-								   invert_transform_flags = [False], # transform flag = 0
-								   args = '--float'),
-			 name = 'warper')
+# Move data from T1 to MNI space with ANTS (one map per contrast).
+warper = MapNode(ants.ApplyTransforms(reference_image = MNI,
+									   dimension = 3,
+									   interpolation = 'Linear',
+									   invert_transform_flags = [False], # transform flag = 0
+									   args = '--float'),
+				 iterfield = ['input_image'],
+				 name = 'warper', **resources['warper'])
+warper.inputs.num_threads = resources['warper']['n_procs']
 
 # Convert to .nii.gz
-zipper = Node(freesurfer.MRIConvert(out_type='niigz'), name = 'zipper')
+zipper = MapNode(Function(input_names  = ["in_file", "compresslevel", "n_threads"],
+						  output_names = ["out_file"],
+						  function = gzip_nifti),
+				 iterfield = ['in_file'],
+				 name = 'zipper', **resources['zipper'])
+zipper.inputs.compresslevel = 1
+zipper.inputs.n_threads     = resources['zipper']['n_procs']
 
 # -------------------------------------------------------------------------------------------------
 # 02. Connect the Nodes
@@ -126,48 +200,77 @@ l1_localizer.connect([(infosource, infohandle, [("subID", "subID"),
 												("sesID", "sesID"),
 												("acqID", "acqID")])])
 l1_localizer.connect([(infohandle, design_bunch, [("log_path", "logfilepath")])])
-l1_localizer.connect([(infohandle, unzip, [("bold_path", "in_file")])])
-l1_localizer.connect([
-				(unzip, modeler, [("out_file", "functional_runs")]),
-				(infohandle, modeler, [("out_path", "outlier_files"),
-									   ("conf_path", "realignment_parameters")]),
-				(design_bunch, modeler, [("design_info", "subject_info")]),
-				(infohandle, modeler, [("TR", "time_repetition")])
-				])
-l1_localizer.connect([
-				(modeler, designer, [("session_info", "session_info")]),
-				(infohandle, designer, [("TR", "interscan_interval")])
-				])
-l1_localizer.connect([
-				(designer, estimator, [("spm_mat_file", "spm_mat_file")])
-				])
-l1_localizer.connect([
-				(estimator, contrastor, [("spm_mat_file", "spm_mat_file")]),
-				(estimator, contrastor, [("beta_images", "beta_images")]),
-				(estimator, contrastor, [("residual_image", "residual_image")]),
-				])
-l1_localizer.connect([
-				(infohandle, warper, [("T1w_toMNI_path", "transforms")]),
-				(contrastor, warper, [("spmT_images", "input_image")])
-				])
-l1_localizer.connect([
-				(warper, zipper, [("output_image", "in_file")])
-				])
-l1_localizer.connect([
-				(contrastor, datasink, [('spm_mat_file', '1stLevel.@spm_mat'),
-                                        ('spmT_images', '1stLevel.@T'),
-                                        ('con_images', '1stLevel.@con')])
-				])
-l1_localizer.connect([
-				(zipper, datasink, [('out_file', '1stLevel.@T_warped')])
-				])
+
+if backend == "spm":
+	l1_localizer.connect([(infohandle, unzip, [("bold_path", "in_file")])])
+	l1_localizer.connect([
+					(unzip, modeler, [("out_file", "functional_runs")]),
+					(infohandle, modeler, [("out_path", "outlier_files"),
+										   ("conf_path", "realignment_parameters")]),
+					(design_bunch, modeler, [("design_info", "subject_info")]),
+					(infohandle, modeler, [("TR", "time_repetition")])
+					])
+	l1_localizer.connect([
+					(modeler, designer, [("session_info", "session_info")]),
+					(infohandle, designer, [("TR", "interscan_interval")])
+					])
+	l1_localizer.connect([
+					(designer, estimator, [("spm_mat_file", "spm_mat_file")])
+					])
+	l1_localizer.connect([
+					(estimator, contrastor, [("spm_mat_file", "spm_mat_file")]),
+					(estimator, contrastor, [("beta_images", "beta_images")]),
+					(estimator, contrastor, [("residual_image", "residual_image")]),
+					])
+	stats = contrastor
+	l1_localizer.connect([
+					(contrastor, datasink, [('spm_mat_file', '1stLevel.@spm_mat'),
+											('spmT_images', '1stLevel.@T'),
+											('con_images', '1stLevel.@con')])
+					])
+else:
+	l1_localizer.connect([
+					(infohandle, glmer, [("bold_path", "bold_path"),
+										 ("mask_path", "mask_path"),
+										 ("TR", "TR"),
+										 ("conf_path", "conf_path"),
+										 ("out_path", "out_path")]),
+					(design_bunch, glmer, [("design_info", "design_info")])
+					])
+	stats = glmer
+	l1_localizer.connect([
+					(glmer, datasink, [('spmT_images', '1stLevel.@T'),
+									   ('con_images', '1stLevel.@con')])
+					])
+
+if warp_maps:
+	l1_localizer.connect([
+					(stats, warper, [("spmT_images", "input_image")]),
+					(infohandle, warper, [("T1w_toMNI_path", "transforms")])
+					])
+	l1_localizer.connect([
+					(warper, zipper, [("output_image", "in_file")])
+					])
+	l1_localizer.connect([
+					(zipper, datasink, [('out_file', '1stLevel.@T_warped')])
+					])
 
 # -------------------------------------------------------------------------------------------------
 # 03. Visualize the Workflow
 # -------------------------------------------------------------------------------------------------
-l1_localizer.write_graph(graph2use = 'colored', format = 'png', simple_form = True)
+if runs:
+	l1_localizer.write_graph(graph2use = 'colored', format = 'png', simple_form = True)
 
 # -------------------------------------------------------------------------------------------------
 # 04. Run the Workflow
 # -------------------------------------------------------------------------------------------------
-res = l1_localizer.run()
\ No newline at end of file
+if not runs:
+	print("Nothing to run: all acquisitions found in the manifest were restored from the result cache.")
+elif plugin == "MultiProc":
+	res = l1_localizer.run(plugin = "MultiProc", plugin_args = {'n_procs': n_procs, 'memory_gb': memory_gb})
+else:
+	res = l1_localizer.run()
+
+# Keep the new results in the cache
+for key, result_dir, _ in to_cache:
+	result_cache.store(key, res_cache, result_dir)
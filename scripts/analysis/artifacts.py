@@ -2,13 +2,86 @@
 # Time-stamp: <2025-05-09 m.utrosa@bcbl.eu>
 
 # Import python packages
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import bids, os, sys
+import numpy as np
+import json, os, sys
 
 # Import custom-made functions (scripts)
 from scripts import grabber
 
-def filter_artifacts(subID, sesID, homePath, confound_keys=None):
+# MRI acquisition labels
+acqIDs = [
+		"DresdenNoFat", "DresdenWFat", "ME1TR880", "ME3TR1600", "ME3TR1100",
+		"ME3TR850", "ME3TR700", "DresdenNoFat175", "DresdenWFat175",
+		"ME1TR780", "ME3TR1180", "ME3TR770", "ME3TR680"
+		]
+
+# Motion confounds selected by default
+motion_keys = ['trans_x', 'trans_y', 'trans_z', 'rot_x', 'rot_y', 'rot_z']
+
+def filter_acquisition(timeseries_path, regressors_path, out_prefix, confound_keys, binary=False):
+	'''
+	Filter confounds and outliers of a single functional run (see filter_artifacts).
+	Only the confound columns and the motion_outlier columns are read from the fMRIprep file.
+	Writes {out_prefix}_confounds.txt and {out_prefix}_outliers.txt.
+	If binary, also writes the same data as .npy files (see save_binary).
+	'''
+	# Load the data, select target confounds from fMRIprep timeseries, and join with tapas regressors.
+	df_timeseries = pd.read_csv(timeseries_path, sep='\t',
+								usecols=lambda key: key in confound_keys or key.startswith('motion_outlier'))
+	df_regressors = pd.read_csv(regressors_path, sep='\t', header=None).reset_index(drop=True)
+	df_selected   = df_timeseries[confound_keys].reset_index(drop=True)
+	df_final      = df_selected.join(df_regressors.add_prefix('tapas_'))
+	df_final.to_csv(f'{out_prefix}_confounds.txt', header=False, index=False, sep=' ')
+
+	# Identify the motion outliers: rows with a 1 in any motion_outlier column.
+	# Indexing starts with 0 in pandas and 1 in LibreOffice ;)
+	outlier_keys = [key for key in df_timeseries.keys() if key.startswith('motion_outlier')]
+	outlier_vols = np.flatnonzero((df_timeseries[outlier_keys].to_numpy() == 1).any(axis=1))
+
+	# Save
+	with open(f'{out_prefix}_outliers.txt', 'w') as f:
+		f.write('\n'.join(map(str, outlier_vols)))
+
+	if binary:
+		save_binary(out_prefix, df_final, outlier_vols)
+
+	return out_prefix
+
+def save_binary(out_prefix, df_confounds, outlier_vols):
+	'''
+	Save confounds and outliers as .npy files next to the text files:
+	- {out_prefix}_confounds.npy  : volumes x regressors, float64, column-major so that
+									each regressor is contiguous on disk
+	- {out_prefix}_confounds.json : sidecar with the column names
+	- {out_prefix}_outliers.npy   : outlier volumes (0-based), int64
+	'''
+	np.save(f'{out_prefix}_confounds.npy', np.asfortranarray(df_confounds.to_numpy(dtype=np.float64)))
+	with open(f'{out_prefix}_confounds.json', 'w') as f:
+		json.dump({'Columns': [str(key) for key in df_confounds.keys()]}, f, indent=4)
+	np.save(f'{out_prefix}_outliers.npy', np.asarray(outlier_vols, dtype=np.int64))
+
+def load_binary(out_prefix, mmap=True):
+	'''
+	Load the files written by save_binary.
+
+	Parameters:
+		out_prefix (str)  : e.g. {homePath}/data_physio/artifacts/sub-01_ses-01_acq-ME3TR1600
+		mmap       (bool) : memory-map the confounds instead of reading them into RAM
+
+	Returns:
+		- confounds: pandas DataFrame (volumes x regressors) with the column names
+		- outliers : numpy array of outlier volumes (0-based)
+	'''
+	confounds = np.load(f'{out_prefix}_confounds.npy', mmap_mode='r' if mmap else None)
+	with open(f'{out_prefix}_confounds.json') as f:
+		columns = json.load(f)['Columns']
+	outliers  = np.load(f'{out_prefix}_outliers.npy')
+
+	return pd.DataFrame(confounds, columns=columns, copy=False), outliers
+
+def filter_artifacts(subID, sesID, homePath, confound_keys=None, binary=False):
 	'''
 	01. Confounds
 	fMRIprep output in csv indicating motion parameters (rot & trans in x, y and z directions)
@@ -22,6 +95,9 @@ def filter_artifacts(subID, sesID, homePath, confound_keys=None):
 	These are added as columns in the same fMRIprep file.
 	Outliers are identified as 1 in the motion_outlier columns.
 	Find the 1 in these columns and extract the volume number (the row number).
+
+	03. Binary output (optional)
+	With binary=True, both are also saved as .npy files (see save_binary and load_binary).
     '''
 
 	# Define paths
@@ -30,19 +106,13 @@ def filter_artifacts(subID, sesID, homePath, confound_keys=None):
 	outputPath    = f"{homePath}/data_physio/artifacts/"
 	os.makedirs(outputPath, exist_ok=True)
 
-	# Specify MRI acquisition labels and get BIDS layout
-	acqIDs = [
-			"DresdenNoFat", "DresdenWFat", "ME1TR880", "ME3TR1600", "ME3TR1100",
-			"ME3TR850", "ME3TR700", "DresdenNoFat175", "DresdenWFat175", 
-			"ME1TR780", "ME3TR1180", "ME3TR770", "ME3TR680"
-			]
-
-	MRILayout    = bids.layout.BIDSLayout(confoundPath,  validate=False, derivatives=True)
-	physioLayout = bids.layout.BIDSLayout(regressorPath, validate=False)
+	# Get BIDS layout
+	MRILayout    = grabber.get_layout(confoundPath,  derivatives=True)
+	physioLayout = grabber.get_layout(regressorPath)
 
 	# Specify confounds
 	if not confound_keys:
-		confound_keys = ['trans_x', 'trans_y', 'trans_z', 'rot_x', 'rot_y', 'rot_z']
+		confound_keys = motion_keys
 
 	# Loop through fMRIprep confound files
 	for i in acqIDs:
@@ -55,30 +125,66 @@ def filter_artifacts(subID, sesID, homePath, confound_keys=None):
 		regressors = grabber.grab_BIDS_object(regressorPath, physioLayout, regressor_conf)
 
 		if timeseries:
-
-			# Load the data, select target confounds from fMRIprep timeseries, and join with tapas regressors.
-			df_timeseries = pd.read_csv(timeseries[0].path, sep='\t')
-			df_regressors = pd.read_csv(regressors[0].path, sep='\t', header=None).reset_index(drop=True)
-			df_selected   = df_timeseries[confound_keys].reset_index(drop=True)
-			df_final      = df_selected.join(df_regressors)
-			df_final.to_csv(f'{outputPath}/sub-{subID:02d}_ses-{sesID:02d}_acq-{i}_confounds.txt', header=False, index=False,
-							sep=' ')
-
-			# Identify the motion outliers and associated rows. Indexing starts with 0 in pandas and 1 in LibreOffice ;)
-			outlier_vols = []
-			for key in df_timeseries.keys():
-				if key.startswith('motion_outlier'):
-					for row, value in enumerate(df_timeseries[key]):
-						if value == 1:
-							outlier_vols.append(row)
-
-			# Save
-			with open(f'{outputPath}/sub-{subID:02d}_ses-{sesID:02d}_acq-{i}_outliers.txt', 'w') as f:
-				f.write('\n'.join(map(str, outlier_vols)))
+			filter_acquisition(timeseries[0].path, regressors[0].path,
+							   f'{outputPath}/sub-{subID:02d}_ses-{sesID:02d}_acq-{i}', confound_keys, binary)
 
 			# Return progress report
 			print(f"Filtered artifacts for functional scanning sequence with acquisition ID: {i}")
 
+def filter_artifacts_batch(homePath, subjects=None, sessions=None, confound_keys=None, n_procs=None,
+						   binary=False):
+	'''
+	Filter artifacts of all subjects, sessions and acquisitions at once (see filter_artifacts).
+	The input files are found with one query per layout and the runs are processed over a process pool.
+
+	Parameters:
+		homePath      (str)  : project folder
+		subjects      (list) : subject IDs (int); all subjects if None
+		sessions      (list) : session IDs (int); all sessions if None
+		confound_keys (list) : fMRIprep confounds to keep; motion parameters if None
+		n_procs       (int)  : number of worker processes; all CPUs if None
+		binary        (bool) : also save the artifacts as .npy files
+	'''
+
+	# Define paths
+	confoundPath  = f"{homePath}/data_MRI/"
+	regressorPath = f"{homePath}/data_physio/raw/"
+	outputPath    = f"{homePath}/data_physio/artifacts/"
+	os.makedirs(outputPath, exist_ok=True)
+
+	if not confound_keys:
+		confound_keys = motion_keys
+
+	# Grab all the files and pair each fMRIprep confound file with its TAPAS regressors
+	entities   = dict(subject=subjects, session=sessions, acquisition=acqIDs, extension="tsv")
+	timeseries = grabber.grab_BIDS_table(grabber.get_layout(confoundPath, derivatives=True),
+										 suffix="timeseries", **entities)
+	regressors = grabber.grab_BIDS_table(grabber.get_layout(regressorPath),
+										 suffix="regressors", **entities)
+	if timeseries.empty:
+		print(f"No fMRIprep confounds found in {confoundPath} ! :()")
+		return
+
+	runs = timeseries.merge(regressors, on=['subject', 'session', 'acquisition'], how='left',
+							suffixes=('_timeseries', '_regressors'))
+	missing = runs['path_regressors'].isna()
+	for _, run in runs[missing].iterrows():
+		print(f"WARNING: No TAPAS regressors for sub-{run.subject} ses-{run.session} acq-{run.acquisition}, skipping.")
+	runs = runs[~missing]
+
+	# Filter all runs in parallel
+	with ProcessPoolExecutor(max_workers=n_procs) as pool:
+		jobs = [pool.submit(filter_acquisition, run.path_timeseries, run.path_regressors,
+							f'{outputPath}/sub-{run.subject}_ses-{run.session}_acq-{run.acquisition}',
+							confound_keys, binary)
+				for run in runs.itertuples()]
+		for job in jobs:
+			print(f"Filtered artifacts: {os.path.basename(job.result())}")
+
 if __name__ == "__main__":
-	subID, sesID, homePath = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
-	filter_artifacts(subID, sesID, homePath)
\ No newline at end of file
+	# Either: <subID> <sesID> <homePath>, or: <homePath> for all subjects and sessions.
+	if len(sys.argv) == 2:
+		filter_artifacts_batch(sys.argv[1])
+	else:
+		subID, sesID, homePath = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+		filter_artifacts(subID, sesID, homePath)
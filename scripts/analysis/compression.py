@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+# -----------------------------------------------------------------------------
+# In-process (de)compression of NIfTI images for the first-level workflow,
+# replacing the FreeSurfer MRIConvert nodes. A .nii.gz file is a gzipped .nii,
+# so the data are streamed through gzip without loading the image.
+# -----------------------------------------------------------------------------
+
+def gunzip_nifti(in_file, cache_dir):
+	"""
+	Decompress a .nii.gz image for SPM. The result is kept in cache_dir, keyed by the path,
+	size and modification time of in_file, and reused on later runs of the workflow.
+
+	Parameters:
+		in_file   (str) : path to the .nii.gz image
+		cache_dir (str) : folder where decompressed images are kept
+
+	Returns:
+		the path to the .nii image
+	"""
+	import gzip, hashlib, os, shutil
+
+	stat     = os.stat(in_file)
+	key      = hashlib.sha1(f"{os.path.abspath(in_file)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+	out_file = os.path.join(cache_dir, key[:16], os.path.basename(in_file)[:-len(".gz")])
+
+	if not os.path.exists(out_file):
+		os.makedirs(os.path.dirname(out_file), exist_ok=True)
+		tmp_file = f"{out_file}.{os.getpid()}"
+		with gzip.open(in_file, 'rb') as src, open(tmp_file, 'wb') as dst:
+			shutil.copyfileobj(src, dst, length=16 << 20)
+		os.replace(tmp_file, out_file) # atomic, nodes may run in parallel
+
+	return out_file
+
+def gzip_nifti(in_file, compresslevel=1, n_threads=1):
+	"""
+	Compress a .nii image into the current (node) directory, named like MRIConvert
+	outputs (<name>_out.nii.gz). Uses pigz when n_threads > 1 and pigz is installed.
+
+	Parameters:
+		in_file       (str) : path to the .nii image (or a list with one path)
+		compresslevel (int) : 1 (fastest) to 9 (smallest)
+		n_threads     (int) : number of pigz threads
+
+	Returns:
+		the path to the .nii.gz image
+	"""
+	import gzip, os, shutil, subprocess
+
+	if isinstance(in_file, list):
+		in_file = in_file[0]
+	out_file = os.path.join(os.getcwd(), os.path.basename(in_file)[:-len(".nii")] + "_out.nii.gz")
+
+	if n_threads > 1 and shutil.which("pigz"):
+		with open(out_file, 'wb') as dst:
+			subprocess.run(["pigz", f"-{compresslevel}", "-p", str(n_threads), "-c", in_file],
+						   stdout=dst, check=True)
+	else:
+		with open(in_file, 'rb') as src, gzip.open(out_file, 'wb', compresslevel=compresslevel) as dst:
+			shutil.copyfileobj(src, dst, length=16 << 20)
+
+	return out_file
@@ -1,3 +1,98 @@
+import os
+
+# Folder holding the parsed designs. Override with $DESIGN_CACHE.
+DESIGN_CACHE = os.environ.get("DESIGN_CACHE",
+							  os.path.join(os.path.expanduser("~"), ".cache", "localizer_designs"))
+
+# Part of the cache key. Bump it when the parsed designs change without a change to
+# parse_logfiles itself (e.g. a new pandas behaviour); edits of the parser change the key anyway.
+DESIGN_CACHE_VERSION = 1
+
+def parse_logfiles(logfilepaths):
+	"""
+	Parse Expyriment logfiles into onsets and durations per condition, all files in one pass.
+
+	Parameters:
+	    logfilepaths (list): List of file paths to logfiles.
+
+	Returns:
+	    list: A dictionary per logfile with the conditions, onsets and durations.
+	"""
+	import pandas as pd
+
+	# Skip the rows with expyriment software info and experiment timestamp; keep 'n/a' as text.
+	logs = pd.concat([pd.read_csv(path, sep=';', skiprows=2, dtype=str, keep_default_na=False)
+					  .iloc[:, [0, 1, 2, 4]].set_axis(['onset', 'duration', 'stim_file', 'response'], axis=1)
+					  for path in logfilepaths], keys=range(len(logfilepaths)), names=['log', 'row'])
+	logs[['onset', 'duration']] = logs[['onset', 'duration']].astype(float)
+	stim_file = logs['stim_file']
+
+	# Silences
+	is_silence = stim_file == 'null_event.wav'
+
+	# Sounds: a sound stays on screen for several rows, count only the first row of each sound.
+	# Repeated rows of the same sound with a response are key presses during the sound.
+	is_sound   = stim_file.str.startswith('s3')
+	sound_prev = stim_file.where(is_sound).groupby(level='log').transform(lambda s: s.ffill().shift())
+	is_new     = is_sound & (stim_file != sound_prev)
+	responded  = logs['response'] != 'n/a'
+
+	# Key presses during sounds and after sounds
+	is_keypress = responded & ((is_sound & ~is_new) | (stim_file == 'n/a'))
+
+	for _, line in logs[~(is_silence | is_sound | (stim_file == 'n/a'))].iterrows():
+		print('WARNING: Skipping unrecognised line "{}"'.format(line.tolist()))
+
+	conditions = ['sound', 'silence', 'keypress']
+	designs = []
+	for i in range(len(logfilepaths)):
+		events = [logs.loc[i][mask.loc[i]] for mask in [is_new, is_silence, is_keypress]]
+		designs.append({'conditions': conditions,
+						'onsets'    : [cond['onset'].tolist()    for cond in events],
+						'durations' : [cond['duration'].tolist() for cond in events]})
+	return designs
+
+def localizer_batch(logfilepaths, cache_dir=DESIGN_CACHE):
+	"""
+	Parse logfiles into design matrices in NiPype Bunch format. Designs are cached
+	by the content hash of the logfile and of the parser (DESIGN_CACHE_VERSION and
+	the source of parse_logfiles), so unchanged logfiles are never parsed twice by
+	the same parser.
+
+	Parameters:
+	    logfilepaths (list): List of file paths to logfiles.
+	    cache_dir    (str) : Folder where the parsed designs are stored.
+
+	Returns:
+	    list: A list of Bunch objects containing design information.
+	"""
+	import hashlib, inspect, pickle
+	from nipype.interfaces.base import Bunch
+
+	parser = hashlib.sha1(f"{DESIGN_CACHE_VERSION}\n{inspect.getsource(parse_logfiles)}".encode())
+
+	os.makedirs(cache_dir, exist_ok=True)
+	cache_files = []
+	for path in logfilepaths:
+		key = parser.copy()
+		with open(path, 'rb') as logfile:
+			key.update(logfile.read())
+		cache_files.append(os.path.join(cache_dir, key.hexdigest() + '.pkl'))
+
+	# Parse only the logfiles that are not cached yet
+	todo = [i for i, cache_file in enumerate(cache_files) if not os.path.exists(cache_file)]
+	if todo:
+		for i, design in zip(todo, parse_logfiles([logfilepaths[i] for i in todo])):
+			with open(cache_files[i] + f'.{os.getpid()}', 'wb') as f:
+				pickle.dump(design, f)
+			os.replace(cache_files[i] + f'.{os.getpid()}', cache_files[i]) # atomic, nodes may run in parallel
+
+	designs = []
+	for cache_file in cache_files:
+		with open(cache_file, 'rb') as f:
+			designs.append(Bunch(**pickle.load(f)))
+	return designs
+
 def localizer(logfilepath):
 	"""
 	Parse logfiles into design matrix in NiPype Bunch format.
@@ -8,47 +103,6 @@ def localizer(logfilepath):
 	Returns:
 	    list: A list of Bunch objects containing design information.
 	"""
-	import csv
-	from nipype.interfaces.base import Bunch
-	
-	# Get info on stimuli onset, duration and key presses.
-	sounds, silences, keypress, sound_prev = [], [], [], []
-	with open(logfilepath, 'r') as logfile:
-		logTsv  = csv.reader(logfile, delimiter=";")
-
-		next(logTsv) # Skip row with expyriment software info
-		next(logTsv) # Skip row with experiment timestamp
-		next(logTsv) # Skip header row
-
-		for line in logTsv:
-			event     = {'onset': float(line[0]), 'duration': float(line[1])}
-			stim_file = line[2]
-
-			# Silences
-			if stim_file == 'null_event.wav':
-				silences.append(event)
-
-			# Sounds with key press during
-			elif stim_file.startswith('s3'):
-				if stim_file != sound_prev:
-					sounds.append(event)
-					sound_prev = stim_file
-				else:
-					if line[4] != 'n/a':
-						keypress.append(event)
-
-			# Sounds with key press after
-			elif stim_file == 'n/a':
-				if line[4] != 'n/a':
-					keypress.append(event)
-			else:
-				print('WARNING: Skipping unrecognised line "{}"'.format(line))
-
-	# Incorporate into design info
-	conditions = ['sound', 'silence', 'keypress']
-	onsets     = [[on['onset'] for on in cond] for cond in [sounds, silences, keypress]]
-	durations  = [[du['duration'] for du in cond] for cond in [sounds, silences, keypress]]
-	design_info = Bunch(conditions = conditions,
-				   		onsets     = onsets,
-				   		durations  = durations)
-	return design_info
\ No newline at end of file
+	from designs_v02 import localizer_batch
+	design_info = localizer_batch([logfilepath])[0]
+	return design_info
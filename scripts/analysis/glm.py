@@ -0,0 +1,193 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+# -----------------------------------------------------------------------------
+# First-level GLM in NumPy, as a fast alternative to the SPM nodes
+# (SpecifySPMModel -> Level1Design -> EstimateModel -> EstimateContrast).
+#
+# The design follows SPM's defaults: canonical HRF (no derivatives) sampled at
+# microtime bin 8 of 16, realignment/TAPAS confounds, one spike regressor per
+# outlier volume, and a DCT high-pass filter (128 s). Differences to SPM:
+# ordinary least squares (no AR(1) prewhitening), no grand mean scaling, and
+# the fMRIprep brain mask is used instead of SPM's implicit mask.
+# -----------------------------------------------------------------------------
+
+# Import python packages
+import os, math
+import numpy as np
+import nibabel as nib
+
+# -----------------------------------------------------------------------------
+# DEFINE FUNCTIONS
+# -----------------------------------------------------------------------------
+def canonical_hrf(dt, length = 32):
+	'''
+	SPM canonical HRF (peak at 6 s, undershoot at 16 s, ratio 1/6) sampled every dt seconds.
+	'''
+	t = np.arange(0, length, dt)
+	gamma_pdf = lambda a: np.exp((a - 1) * np.log(np.maximum(t, 1e-12)) - t - math.lgamma(a))
+	hrf = gamma_pdf(6) - gamma_pdf(16) / 6
+	return hrf / hrf.sum()
+
+def dct_basis(n_vols, TR, cutoff = 128):
+	'''
+	Discrete cosine set of SPM's high-pass filter (without the constant term).
+	'''
+	order = int(2 * (n_vols * TR) / cutoff + 1)
+	t = np.arange(n_vols)
+	return np.array([np.sqrt(2 / n_vols) * np.cos(np.pi * (2 * t + 1) * k / (2 * n_vols))
+					 for k in range(1, order)]).reshape(-1, n_vols).T
+
+def design_matrix(design_info, TR, n_vols, confounds = None, outliers = None, high_pass = 128,
+				  microtime = 16):
+	'''
+	Build the first-level design matrix.
+
+	Parameters:
+	- design_info: Bunch, with conditions, onsets and durations (see designs_v02.localizer)
+	- TR: float, repetition time [sec]
+	- n_vols: integer, number of volumes
+	- confounds: numpy array (volumes x regressors), e.g. motion and TAPAS regressors
+	- outliers: list of outlier volumes (0-based)
+	- high_pass: float, high-pass filter cutoff [sec]; no filter if None
+	- microtime: integer, number of time bins per TR used for the convolution
+
+	Returns:
+	- X: numpy array (volumes x columns)
+	- names: list of column names
+	'''
+	dt  = TR / microtime
+	hrf = canonical_hrf(dt)
+	n_bins = n_vols * microtime
+	scans  = np.arange(n_vols) * microtime + microtime // 2 - 1 # SPM's fMRI_T0 = 8 (1-based)
+
+	columns, names = [], []
+	for name, onsets, durations in zip(design_info.conditions, design_info.onsets, design_info.durations):
+		boxcar = np.zeros(n_bins)
+		for onset, duration in zip(onsets, durations):
+			start = int(round(onset / dt))
+			boxcar[start:max(start + 1, int(round((onset + duration) / dt)))] = 1
+		columns.append(np.convolve(boxcar, hrf)[:n_bins][scans])
+		names.append(name)
+
+	if confounds is not None and len(confounds):
+		confounds = np.asarray(confounds, dtype = np.float64).reshape(n_vols, -1)
+		columns.extend(confounds.T)
+		names.extend(f"confound_{i:02d}" for i in range(confounds.shape[1]))
+
+	for vol in (outliers if outliers is not None else []):
+		spike = np.zeros(n_vols)
+		spike[int(vol)] = 1
+		columns.append(spike)
+		names.append(f"outlier_{int(vol):04d}")
+
+	if high_pass:
+		dct = dct_basis(n_vols, TR, high_pass)
+		columns.extend(dct.T)
+		names.extend(f"drift_{i:02d}" for i in range(dct.shape[1]))
+
+	columns.append(np.ones(n_vols))
+	names.append("constant")
+
+	return np.column_stack(columns), names
+
+def fit_glm(bold, mask, X, chunk_size = 32):
+	'''
+	Fit the GLM to all voxels in the mask at once. The BOLD series is read chunk_size
+	volumes at a time (float32) from a file that is kept open, and only X'Y and Y'Y are
+	accumulated, so memory does not grow with the number of volumes.
+
+	Returns:
+	- beta: numpy array (columns x voxels)
+	- sigma2: numpy array (voxels), residual variance
+	- XtX_inv: numpy array (columns x columns), pseudo-inverse of X'X
+	- df: integer, residual degrees of freedom
+	- inside: numpy array, flat indices (C order) of the voxels in the mask
+	'''
+	img    = nib.load(bold, keep_file_open = True) if isinstance(bold, str) else bold
+	inside = np.flatnonzero(np.asanyarray(nib.load(mask).dataobj) > 0)
+
+	XtY = np.zeros((X.shape[1], inside.size))
+	YtY = np.zeros(inside.size)
+	for start in range(0, img.shape[3], chunk_size):
+		chunk = np.asanyarray(img.dataobj[..., start:start + chunk_size], dtype = np.float32)
+		Y     = chunk.reshape(-1, chunk.shape[3])[inside].T.astype(np.float64)
+		XtY  += X[start:start + Y.shape[0]].T @ Y
+		YtY  += (Y ** 2).sum(axis = 0)
+
+	XtX_inv = np.linalg.pinv(X.T @ X)
+	beta    = XtX_inv @ XtY
+	df      = X.shape[0] - np.linalg.matrix_rank(X)
+	sigma2  = np.maximum(YtY - (beta * XtY).sum(axis = 0), 0) / df
+
+	return beta, sigma2, XtX_inv, df, inside
+
+def run_glm(bold_path, mask_path, design_info, TR, conf_path, out_path, contrasts, out_dir,
+			high_pass = 128, chunk_size = 32):
+	'''
+	Fit a first-level model and write beta, con and spmT maps with SPM's file names
+	(beta_0001.nii, con_0001.nii, spmT_0001.nii) plus the design matrix (design.tsv).
+
+	Parameters:
+	- bold_path: string, preprocessed BOLD series
+	- mask_path: string, brain mask in the same space
+	- design_info: Bunch, output of designs_v02.localizer
+	- TR: float, repetition time [sec]
+	- conf_path: string, confounds file written by artifacts.filter_artifacts (or None)
+	- out_path: string, outliers file written by artifacts.filter_artifacts (or None)
+	- contrasts: list of Nipype-style T contrasts, e.g. [('localizer', 'T', ['sound', 'silence'], [1, -1])]
+	- out_dir: string, output folder
+	- high_pass: float, high-pass filter cutoff [sec]
+	- chunk_size: integer number of volumes held in memory at once
+
+	Returns:
+	- beta_images, con_images, spmT_images: lists of paths
+	'''
+	# Keep the (gzip) file open, so that each chunk continues from the previous one
+	# instead of decompressing the series from the start again.
+	img    = nib.load(bold_path, keep_file_open = True)
+	n_vols = img.shape[3]
+
+	confounds = np.loadtxt(conf_path, ndmin = 2) if conf_path else None
+	outliers  = []
+	if out_path:
+		with open(out_path) as f:
+			outliers = [int(vol) for vol in f.read().split()]
+
+	X, names = design_matrix(design_info, TR, n_vols, confounds, outliers, high_pass)
+	beta, sigma2, XtX_inv, df, inside = fit_glm(img, mask_path, X, chunk_size)
+
+	os.makedirs(out_dir, exist_ok = True)
+	np.savetxt(os.path.join(out_dir, "design.tsv"), X, delimiter = '\t', header = '\t'.join(names), comments = '')
+
+	def save_map(values, filename):
+		data = np.full(img.shape[:3], np.nan, dtype = np.float32)
+		data.flat[inside] = values
+		path = os.path.join(out_dir, filename)
+		nib.save(nib.Nifti1Image(data, img.affine), path)
+		return path
+
+	beta_images = [save_map(b, f"beta_{i + 1:04d}.nii") for i, b in enumerate(beta)]
+
+	con_images, spmT_images = [], []
+	for i, (name, stat, conditions, weights) in enumerate(contrasts):
+		if stat != 'T':
+			raise ValueError(f"Contrast {name}: only T contrasts are supported, not {stat}.")
+		c   = np.zeros(X.shape[1])
+		c[[names.index(cond) for cond in conditions]] = weights
+		con = c @ beta
+		se  = np.sqrt(sigma2 * (c @ XtX_inv @ c))
+		con_images.append(save_map(con, f"con_{i + 1:04d}.nii"))
+		spmT_images.append(save_map(np.divide(con, se, out = np.zeros_like(con), where = se > 0),
+									f"spmT_{i + 1:04d}.nii"))
+
+	return beta_images, con_images, spmT_images
+
+def glm_node(bold_path, mask_path, design_info, TR, conf_path, out_path, contrasts, high_pass):
+	'''
+	Nipype Function node wrapper of run_glm, writing into the node's working directory.
+	'''
+	import os
+	from glm import run_glm
+	beta_images, con_images, spmT_images = run_glm(bold_path, mask_path, design_info, TR, conf_path,
+												   out_path, contrasts, os.getcwd(), high_pass)
+	return beta_images, con_images, spmT_images
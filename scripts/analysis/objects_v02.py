@@ -1,50 +1,114 @@
 #! /usr/bin/env python
 # Time-stamp: <2025-05-09 m.utrosa@bcbl.eu>
 
-def grab_objects(subID, sesID, acqID, homePath):
-	import bids, grabber
-	
-	# Set up layout
-	mripath   = f"{homePath}/data_MRI/"
-	mriLayout = bids.layout.BIDSLayout(mripath, validate=False, derivatives=True)
-	
+# Outputs of grab_objects, in order. TR is the last one.
+OUTPUT_NAMES = ["log_path", "bold_path", "mask_path", "conf_path", "out_path", "T1w_path",
+				"T1w_toMNI_path", "fsNative_toT1w_path", "TR"]
+
+def open_layouts(homePath):
+	"""
+	Set up the three layouts needed by resolve_objects (MRI with derivatives, logs, artifacts).
+	"""
+	import grabber
+
+	mriLayout = grabber.get_layout(f"{homePath}/data_MRI/", derivatives=True)
+
 	# TO-DO: maybe not necessary to have import_LOG.py function ....
-	logpath   = f"{homePath}/data_logs/bids/"
-	logLayout = bids.layout.BIDSLayout(logpath, validate=False)
+	logLayout = grabber.get_layout(f"{homePath}/data_logs/bids/")
+	artLayout = grabber.get_layout(f"{homePath}/data_physio/")
+
+	return mriLayout, logLayout, artLayout
+
+def resolve_objects(subID, sesID, acqID, layouts):
+	"""
+	Find all files required for the analysis of one acquisition in already opened layouts.
+	Returns the values listed in OUTPUT_NAMES.
+	"""
+	import grabber
+	mriLayout, logLayout, artLayout = layouts
 
-	artpath    = f"{homePath}/data_physio/"
-	artLayout  = bids.layout.BIDSLayout(artpath, validate=False)
-	
 	# Configuration
 	## Log files
 	log_conf   = grabber.define_grabconf(subID, sesID, "events", 	"tsv",    acquisition = acqID)
-	
+
 	## Funcional files
 	bold_conf   = grabber.define_grabconf(subID, sesID, "bold",      "nii.gz", acquisition = acqID, space = "MNI152NLin2009cAsym")
-	bold_object = grabber.grab_BIDS_object(mripath, mriLayout, bold_conf)
-	
+	bold_object = grabber.grab_BIDS_object(mriLayout.root, mriLayout, bold_conf)
+
 	## Outliers and confounds
 	mask_conf  = grabber.define_grabconf(subID, sesID, "mask",      "nii.gz", acquisition = acqID, space = "MNI152NLin2009cAsym")
 	conf_conf  = grabber.define_grabconf(subID, sesID, "confounds", "txt",    acquisition = acqID)
 	out_conf   = grabber.define_grabconf(subID, sesID, "outliers",  "txt",    acquisition = acqID)
-	
+
 	## Anatomical files
 	sesID = 1 # SUB-OPTIMAL: BECAUSE ANATOMICAL STUFF WAS ONLY COLLECTED IN SES-01
 	T1w_conf   = grabber.define_grabconf(subID, sesID, "T1w",  "nii.gz", space = "MNI152NLin2009cAsym")
 	T1w_toMNI_conf      = grabber.define_grabconf(subID, sesID, "xfm",  "h5")
 	fsNative_toT1w_conf = grabber.define_grabconf(subID, sesID, "xfm",  "txt")
-	
+
 	# Grabbing files
-	log_path   = grabber.grab_BIDS_object(logpath, logLayout, log_conf)[0].path
+	log_path   = grabber.grab_BIDS_object(logLayout.root, logLayout, log_conf)[0].path
 	bold_path  = bold_object[0].path
-	mask_path  = grabber.grab_BIDS_object(mripath, mriLayout, mask_conf)[0].path
-	conf_path  = grabber.grab_BIDS_object(artpath, artLayout, conf_conf)[0].path
-	out_path   = grabber.grab_BIDS_object(artpath, artLayout, out_conf)[0].path
-	T1w_path   = grabber.grab_BIDS_object(mripath, mriLayout, T1w_conf)[0].path
-	T1w_toMNI_path      = grabber.grab_BIDS_object(mripath, mriLayout, T1w_toMNI_conf)[1].path
-	fsNative_toT1w_path = grabber.grab_BIDS_object(mripath, mriLayout, fsNative_toT1w_conf)[0].path
+	mask_path  = grabber.grab_BIDS_object(mriLayout.root, mriLayout, mask_conf)[0].path
+	conf_path  = grabber.grab_BIDS_object(artLayout.root, artLayout, conf_conf)[0].path
+	out_path   = grabber.grab_BIDS_object(artLayout.root, artLayout, out_conf)[0].path
+	T1w_path   = grabber.grab_BIDS_object(mriLayout.root, mriLayout, T1w_conf)[0].path
+	T1w_toMNI_path      = grabber.grab_BIDS_object(mriLayout.root, mriLayout, T1w_toMNI_conf)[1].path
+	fsNative_toT1w_path = grabber.grab_BIDS_object(mriLayout.root, mriLayout, fsNative_toT1w_conf)[0].path
 
 	# Extract repetition time with PyBIDS methods [sec]
 	TR = bold_object[0].get_metadata()['RepetitionTime']
 
-	return log_path, bold_path, mask_path, conf_path, out_path, T1w_path, T1w_toMNI_path, fsNative_toT1w_path, TR
\ No newline at end of file
+	return log_path, bold_path, mask_path, conf_path, out_path, T1w_path, T1w_toMNI_path, fsNative_toT1w_path, TR
+
+def build_manifest(sub_list, ses_list, acqID_list, homePath, manifest_path):
+	"""
+	Resolve the inputs of every (subject, session, acquisition) iterable in one pass
+	and save them as a table that grab_objects can look up instead of indexing the data.
+
+	Parameters:
+		sub_list      (list) : subject IDs (int)
+		ses_list      (list) : session IDs (int)
+		acqID_list    (list) : acquisition labels (str)
+		homePath      (str)  : project folder
+		manifest_path (str)  : where to save the table (.tsv)
+
+	Returns:
+		the path to the manifest
+	"""
+	import itertools, os
+	import pandas as pd
+
+	layouts = open_layouts(homePath)
+
+	rows = []
+	for subID, sesID, acqID in itertools.product(sub_list, ses_list, acqID_list):
+		try:
+			objects = resolve_objects(subID, sesID, acqID, layouts)
+		except IndexError:
+			print(f"WARNING: Missing files for sub-{subID:02d} ses-{sesID:02d} acq-{acqID}, not added to the manifest.")
+			continue
+		rows.append({'subID': subID, 'sesID': sesID, 'acqID': acqID, **dict(zip(OUTPUT_NAMES, objects))})
+
+	if not rows:
+		print(f"WARNING: No inputs found for any of sub {sub_list}, ses {ses_list}, acq {acqID_list}; the manifest is empty.")
+
+	# Write the header even without rows, so that the manifest can always be read back.
+	os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+	pd.DataFrame(rows, columns=['subID', 'sesID', 'acqID'] + OUTPUT_NAMES).to_csv(manifest_path, sep='\t', index=False)
+
+	return manifest_path
+
+def grab_objects(subID, sesID, acqID, homePath, manifest=None):
+	"""
+	Find all files required for the analysis of one acquisition. If a manifest made by
+	build_manifest is given, the paths are looked up there and no layout is built.
+	"""
+	if manifest:
+		import pandas as pd
+		table = pd.read_csv(manifest, sep='\t', index_col=['subID', 'sesID', 'acqID'])
+		row   = table.loc[(subID, sesID, acqID)]
+		return tuple(row[name] for name in OUTPUT_NAMES[:-1]) + (float(row['TR']),)
+
+	from objects_v02 import open_layouts, resolve_objects
+	return resolve_objects(subID, sesID, acqID, open_layouts(homePath))
@@ -7,9 +7,11 @@
 # DOI: 10.7554/eLife.48932
 # -----------------------------------------------------------------------------
 import nibabel as nib
-from nilearn.image import resample_to_img
 from nibabel.orientations import aff2axcodes, io_orientation
 
+# Import custom-made functions
+from resampler import resample_cached
+
 # Download Sitek et al. (2019) atlas of subcortical brain regions from:
 # https://osf.io/c4m82/files/osfstorage -> derivatives/MNI_space/atlases
 homePath   = "/home/mutrosa/Documents/projects/localizer_fMRI"
@@ -24,9 +26,8 @@ out_path = f"{out_dir}invivo_resampled_to-MNI_res-01.nii.gz"
 atlas_img = nib.load(atlas_path)
 MNI_img   = nib.load(MNI_path)
 
-# Resample
-resampled_atlas = resample_to_img(atlas_img, MNI_img, interpolation='continuous', 
-								  copy_header=True, force_resample=True)
+# Resample (labels are kept intact, repeated runs are served from the cache)
+resampled_atlas = resample_cached(atlas_path, MNI_img, interpolation='label')
 resampled_atlas.to_filename(out_path)
 
 # Check that the transformation has been correctly executed
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+# -----------------------------------------------------------------------------
+# Resample images to the grid of another image, with an on-disk cache and a
+# label-preserving mode for atlases.
+# -----------------------------------------------------------------------------
+import hashlib, os
+import numpy as np
+import nibabel as nib
+from nilearn.image import resample_img
+
+# Folder holding the resampled images. Override with $RESAMPLE_CACHE.
+RESAMPLE_CACHE = os.environ.get("RESAMPLE_CACHE",
+								os.path.join(os.path.expanduser("~"), ".cache", "resampled_images"))
+
+def resample_labels(atlas_img, target_affine, target_shape):
+	"""
+	Resample an integer label atlas without mixing labels. Every target voxel gets the
+	label most of its source voxels have (majority vote); target voxels that receive no
+	source voxel (upsampling) get the nearest-neighbour label.
+	"""
+	labels = np.rint(np.asanyarray(atlas_img.dataobj)).astype(np.int32)
+	out    = np.asanyarray(resample_img(nib.Nifti1Image(labels, atlas_img.affine),
+										target_affine=target_affine, target_shape=target_shape,
+										interpolation='nearest', force_resample=True).dataobj).copy()
+
+	# Only the box around the labelled voxels can differ from the background.
+	nonzero = np.argwhere(labels)
+	if not nonzero.size:
+		return nib.Nifti1Image(out, target_affine)
+	ratio  = np.ceil(np.abs(np.diag(target_affine)[:3] / np.diag(atlas_img.affine)[:3])).astype(int)
+	lo     = np.maximum(nonzero.min(axis=0) - ratio, 0)
+	hi     = np.minimum(nonzero.max(axis=0) + ratio + 1, labels.shape[:3])
+	box    = labels[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+
+	# Map every source voxel of the box to its target voxel.
+	ijk    = np.indices(box.shape).reshape(3, -1) + lo[:, None]
+	xyz    = atlas_img.affine @ np.vstack([ijk, np.ones(ijk.shape[1])])
+	tgt    = np.rint(np.linalg.inv(target_affine) @ xyz)[:3].astype(int)
+	inside = np.all((tgt >= 0) & (tgt < np.array(target_shape)[:, None]), axis=0)
+	voxel  = np.ravel_multi_index(tgt[:, inside], target_shape)
+
+	# Majority vote: count (target voxel, label) pairs, keep the most frequent label per voxel.
+	uniq, code   = np.unique(box.ravel()[inside], return_inverse=True)
+	pairs, count = np.unique(voxel * len(uniq) + code.ravel(), return_counts=True)
+	order        = np.lexsort((-count, pairs // len(uniq)))
+	pairs        = pairs[order]
+	first        = np.r_[True, np.diff(pairs // len(uniq)) != 0]
+	out.flat[pairs[first] // len(uniq)] = uniq[pairs[first] % len(uniq)]
+
+	return nib.Nifti1Image(out, target_affine)
+
+def resample_cached(source, target, interpolation='continuous', cache_dir=RESAMPLE_CACHE):
+	"""
+	Resample an image to the grid of another one, reusing earlier results. Results are stored
+	in cache_dir, keyed by the content of the source image, the target affine and shape,
+	and the interpolation.
+
+	Parameters:
+		source        (str)   : path to the image to resample
+		target        (str)   : path to (or nibabel image of) the image defining the target grid
+		interpolation (str)   : 'continuous', 'linear' or 'nearest' (nilearn), or
+								'label' for integer atlases (see resample_labels)
+		cache_dir     (str)   : folder where the resampled images are stored
+
+	Returns:
+		the resampled nibabel image
+	"""
+	target_img = nib.load(target) if isinstance(target, str) else target
+	affine     = np.asarray(target_img.affine, dtype=np.float64)
+	shape      = tuple(int(n) for n in target_img.shape[:3])
+
+	digest = hashlib.sha1()
+	with open(source, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			digest.update(chunk)
+	digest.update(affine.tobytes())
+	digest.update(repr((shape, interpolation)).encode())
+	cache_path = os.path.join(cache_dir, digest.hexdigest() + ".nii.gz")
+
+	if os.path.exists(cache_path):
+		return nib.load(cache_path)
+
+	source_img = nib.load(source)
+	if interpolation == 'label':
+		resampled = resample_labels(source_img, affine, shape)
+	else:
+		resampled = resample_img(source_img, target_affine=affine, target_shape=shape,
+								 interpolation=interpolation, copy_header=True, force_resample=True)
+
+	# Write under a temporary name first: other processes may read the cache meanwhile.
+	os.makedirs(cache_dir, exist_ok=True)
+	tmp_path = cache_path.replace(".nii.gz", f".{os.getpid()}.nii.gz")
+	resampled.to_filename(tmp_path)
+	os.replace(tmp_path, cache_path)
+
+	return nib.load(cache_path)
@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+# -----------------------------------------------------------------------------
+# Content-addressed cache of first-level results. Each acquisition is keyed by
+# the content of its inputs (BOLD, mask, events, confounds, outliers, transform)
+# and by the model parameters, never by paths, so results survive a wiped
+# working directory or a moved project folder.
+# -----------------------------------------------------------------------------
+
+# Import python packages
+import hashlib, json, os, shutil, sqlite3
+
+# Inputs of an acquisition that enter the cache key (columns of the objects_v02 manifest)
+INPUT_FILES = ["log_path", "bold_path", "mask_path", "conf_path", "out_path", "T1w_toMNI_path"]
+
+def file_digest(path, cache_dir):
+	"""
+	SHA-1 of the content of a file. Digests are remembered per (path, size, mtime) in
+	cache_dir, so large BOLD files are hashed only once unless they change or move.
+	"""
+	stat = os.stat(path)
+	memo = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+	with sqlite3.connect(os.path.join(cache_dir, "digests.sqlite"), timeout=60) as db:
+		db.execute("CREATE TABLE IF NOT EXISTS digests (path TEXT, size INTEGER, mtime INTEGER, digest TEXT, "
+				   "PRIMARY KEY (path, size, mtime))")
+		found = db.execute("SELECT digest FROM digests WHERE path = ? AND size = ? AND mtime = ?", memo).fetchone()
+	if found:
+		return found[0]
+
+	digest = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(16 << 20), b''):
+			digest.update(chunk)
+
+	with sqlite3.connect(os.path.join(cache_dir, "digests.sqlite"), timeout=60) as db:
+		db.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)", memo + (digest.hexdigest(),))
+	return digest.hexdigest()
+
+def result_key(row, params, cache_dir):
+	"""
+	Cache key of one acquisition.
+
+	Parameters:
+		row       (dict) : one row of the objects_v02 manifest (input paths and TR)
+		params    (dict) : model parameters (hrf derivatives, high-pass cutoff, contrasts, ...)
+		cache_dir (str)  : cache folder
+
+	Returns:
+		a hexadecimal key
+	"""
+	os.makedirs(cache_dir, exist_ok=True)
+	content = {name: file_digest(row[name], cache_dir) for name in INPUT_FILES}
+	content['TR']     = float(row['TR'])
+	content['params'] = params
+	return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+def clear(result_dir):
+	"""
+	Remove the results of an earlier run, so that result_dir only holds what the next
+	restore or run writes (and store() caches nothing else).
+	"""
+	shutil.rmtree(result_dir, ignore_errors=True)
+
+def restore(key, cache_dir, result_dir):
+	"""
+	Replace the content of result_dir with the cached results. Returns False (and leaves
+	result_dir untouched) if the key is not cached.
+	"""
+	entry = os.path.join(cache_dir, key)
+	if not os.path.isdir(entry):
+		return False
+	clear(result_dir)
+	shutil.copytree(entry, result_dir)
+	return True
+
+def store(key, cache_dir, result_dir):
+	"""
+	Copy the results in result_dir into the cache under key. result_dir is cleared before
+	the run (see clear), so it only holds the results of this run.
+	"""
+	entry = os.path.join(cache_dir, key)
+	if os.path.isdir(entry) or not os.path.isdir(result_dir):
+		return
+	tmp_entry = f"{entry}.{os.getpid()}"
+	shutil.copytree(result_dir, tmp_entry)
+	os.replace(tmp_entry, entry)
@@ -6,7 +6,8 @@
 # -----------------------------------------------------------------------------
 
 # Import python packages
-import os, bids
+from concurrent.futures import ProcessPoolExecutor
+import os, re, glob, itertools, bids
 import pandas as pd
 import numpy as np
 import nibabel as nib
@@ -17,9 +18,195 @@ from nilearn.image import resample_to_img
 # Import custom-made functions
 import grabber
 
+# Define ROIs
+# Size represents the volume (mm3) of auditory subcortical structures obtained
+# in their in-vivo functional clusters. See Table 1 in Sitek et al. (2019).
+# Label is identified from plotting unique atlas values in freeview.
+ROIS = {'IC-L'  : {'size': 146, 'label': 5},
+		'IC-R'  : {'size': 146, 'label': 6},
+		'MGB-L' : {'size': 152, 'label': 7},
+		'MGB-R' : {'size': 152, 'label': 8}}
+
 # -----------------------------------------------------------------------------
 # DEFINE FUNCTIONS
 # -----------------------------------------------------------------------------
+def group_atlas_voxels(atlas_data, rois):
+	'''
+	Find the voxels of all ROIs in a single pass over the atlas.
+
+	Parameters:
+	- atlas_data: numpy array, atlas labels
+	- rois: dictionary, specifying names, volume and atlas label of target ROIs.
+
+	Returns:
+	- roi_voxels: dictionary, flat voxel indices (C order) per ROI
+	'''
+	flat   = atlas_data.ravel()
+	labels = np.unique([roi['label'] for roi in rois.values()])
+
+	# Keep the voxels of the target labels, then group them by label with one sort.
+	voxels = np.flatnonzero(np.isin(flat, labels))
+	order  = np.argsort(flat[voxels], kind='stable')
+	voxels = voxels[order]
+	bounds = np.searchsorted(flat[voxels], labels)
+	groups = dict(zip(labels, np.split(voxels, bounds[1:])))
+
+	return {name: groups[roi['label']] for name, roi in rois.items()}
+
+def index_atlas(atlas_img, labels=None):
+	'''
+	Precompute, per atlas label, the flat voxel indices and the bounding box.
+	Save it with save_roi_index() so that the dense atlas never has to be scanned again.
+
+	Parameters:
+	- atlas_img: nibabel image of an established atlas
+	- labels: list of atlas labels to index; all non-zero integer labels if None
+
+	Returns:
+	- index: dictionary with the atlas 'shape', 'affine' and, per label, 'voxels' and 'bbox'
+	'''
+	atlas_data = np.asanyarray(atlas_img.dataobj)
+	if labels is None:
+		values = np.unique(atlas_data)
+		labels = values[(values != 0) & (values == np.round(values))].astype(int)
+
+	roi_voxels = group_atlas_voxels(atlas_data, {label: {'label': label} for label in labels})
+
+	index = {'shape': atlas_img.shape[:3], 'affine': atlas_img.affine, 'labels': {}}
+	for label, voxels in roi_voxels.items():
+		ijk  = np.unravel_index(voxels, index['shape'])
+		bbox = np.array([[c.min(), c.max() + 1] if voxels.size else [0, 0] for c in ijk])
+		index['labels'][int(label)] = {'voxels': voxels, 'bbox': bbox}
+
+	return index
+
+def atlas_signature(atlas_path):
+	'''
+	Identify the atlas an index was built from: absolute path, size and modification time.
+	'''
+	stat = os.stat(atlas_path)
+	return {'atlas_path': os.path.abspath(atlas_path), 'atlas_stat': np.array([stat.st_size, stat.st_mtime_ns], dtype = np.int64)}
+
+def save_roi_index(index, index_path, atlas_path = None):
+	'''
+	Save the output of index_atlas() as a .npz file (all labels concatenated, with offsets).
+	If atlas_path is given, its signature is stored so that a stale index can be detected.
+	'''
+	labels = sorted(index['labels'])
+	voxels = [index['labels'][label]['voxels'] for label in labels]
+	np.savez(index_path,
+			 **(atlas_signature(atlas_path) if atlas_path else {}),
+			 shape   = np.array(index['shape']),
+			 affine  = index['affine'],
+			 labels  = np.array(labels, dtype = np.int64),
+			 offsets = np.cumsum([0] + [v.size for v in voxels]),
+			 voxels  = np.concatenate(voxels).astype(np.int64) if voxels else np.zeros(0, dtype = np.int64),
+			 bboxes  = np.array([index['labels'][label]['bbox'] for label in labels]).reshape(-1, 3, 2))
+
+def load_roi_index(index_path):
+	'''
+	Load a .npz file written by save_roi_index(). Returns the same dictionary as index_atlas().
+	'''
+	with np.load(index_path) as f:
+		index = {'shape': tuple(f['shape']), 'affine': f['affine'], 'labels': {}}
+		if 'atlas_path' in f.files:
+			index['atlas_path'], index['atlas_stat'] = str(f['atlas_path']), f['atlas_stat']
+		for i, label in enumerate(f['labels']):
+			index['labels'][int(label)] = {'voxels': f['voxels'][f['offsets'][i]:f['offsets'][i + 1]],
+										   'bbox'  : f['bboxes'][i]}
+	return index
+
+def update_roi_index(atlas_path, index_path):
+	'''
+	Build the index of an atlas unless index_path already holds the index of this very
+	atlas file (same path, size and modification time). Returns the index.
+	'''
+	if os.path.exists(index_path):
+		index     = load_roi_index(index_path)
+		signature = atlas_signature(atlas_path)
+		if index.get('atlas_path') == signature['atlas_path'] and np.array_equal(index['atlas_stat'], signature['atlas_stat']):
+			return index
+		print(f"Atlas {atlas_path} changed since {index_path} was built, indexing it again.")
+
+	save_roi_index(index_atlas(nib.load(atlas_path)), index_path, atlas_path)
+	return load_roi_index(index_path)
+
+def gather_roi_values(img, index, labels = None):
+	'''
+	Read the values of an image inside the indexed ROIs without loading the whole volume.
+	Only the bounding box of the requested labels is read from disk (memory-mapped for .nii).
+
+	Parameters:
+	- img: string (path) or nibabel image, in the same space as the atlas
+	- index: dictionary, output of index_atlas() or load_roi_index()
+	- labels: list of atlas labels; all indexed labels if None
+
+	Returns:
+	- values: dictionary, {label: array of values}
+	'''
+	img = nib.load(img) if isinstance(img, str) else img
+	if tuple(img.shape[:3]) != tuple(index['shape']) or not np.allclose(img.affine, index['affine']):
+		raise ValueError(f"Image {img.get_filename()} is not in the space of the atlas index.")
+
+	labels = list(index['labels']) if labels is None else labels
+	bboxes = np.array([index['labels'][label]['bbox'] for label in labels if index['labels'][label]['voxels'].size])
+	if not bboxes.size:
+		return {label: np.zeros(0) for label in labels}
+
+	# Read the box that contains all requested ROIs
+	lo, hi = bboxes[:, :, 0].min(axis = 0), bboxes[:, :, 1].max(axis = 0)
+	block  = np.asanyarray(img.dataobj[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]])
+
+	values = {}
+	for label in labels:
+		i, j, k = np.unravel_index(index['labels'][label]['voxels'], index['shape'])
+		values[label] = block[i - lo[0], j - lo[1], k - lo[2]]
+
+	return values
+
+def summarize_roi(values):
+	'''
+	Summary statistics of the values in one ROI.
+	'''
+	if not values.size:
+		return {'n_voxels': 0, 'mean': np.nan, 'median': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan}
+	return {'n_voxels': values.size, 'mean': values.mean(), 'median': np.median(values),
+			'std': values.std(), 'min': values.min(), 'max': values.max()}
+
+def extract_rois(atlas, maps, rois):
+	'''
+	Extracts values of many maps (spmT, con, ...) from all regions of interest (ROIs) at once.
+	The atlas is indexed only once, whatever the number of maps, and only the voxels
+	around the ROIs are read from each map.
+
+	Parameters:
+	- atlas: string (path to an atlas image or to an index .npz), nibabel image,
+	         or index dictionary (see index_atlas), in the same space as the maps
+	- maps: dictionary, {label: path} of the maps to extract values from
+	- rois: dictionary, specifying names, volume and atlas label of target ROIs.
+
+	Returns:
+	- values: dictionary, {label: {ROI name: array of values}}
+	- summary: pandas DataFrame, summary statistics per map and ROI
+	'''
+	if isinstance(atlas, dict):
+		index = atlas
+	elif isinstance(atlas, str) and atlas.endswith('.npz'):
+		index = load_roi_index(atlas)
+	else:
+		index = index_atlas(nib.load(atlas) if isinstance(atlas, str) else atlas,
+							[roi['label'] for roi in rois.values()])
+
+	values, rows = {}, []
+	for label, path in maps.items():
+		roi_values    = gather_roi_values(path, index, [roi['label'] for roi in rois.values()])
+		values[label] = {name: roi_values[roi['label']] for name, roi in rois.items()}
+
+		for name, vals in values[label].items():
+			rows.append({'map': label, 'ROI': name, **summarize_roi(vals)})
+
+	return values, pd.DataFrame(rows)
+
 def extract_roi_array(subID, sesID, acqID, atlas, template, spmT, rois, out_dir):
 	'''
 	Extracts spmT values from the specified regions of interest (ROIs).
@@ -42,36 +229,93 @@ def extract_roi_array(subID, sesID, acqID, atlas, template, spmT, rois, out_dir)
 	# Load template image (MNI, T1w)
 	template_img = nib.load(template)
 
-	# Load atlas image (Sitek)
-	atlas_img = nib.load(atlas)
-	atlas_data = atlas_img.get_fdata()
+	# Load atlas image (Sitek) and find the voxels of all ROIs
+	roi_voxels = group_atlas_voxels(np.asanyarray(nib.load(atlas).dataobj), rois)
 
 	# Load SPM's t-values from 1st level analysis in Nipype
-	spmT_img  = nib.load(spmT_path)
-	spmT_data = spmT_img.get_fdata() 
+	spmT_img  = nib.load(spmT)
+	spmT_data = np.asanyarray(spmT_img.dataobj).ravel()
 
-	# Extract ROIs from the atlas
-	spmT_rois = {}
-	for name, roi in rois.items():
-	    mask = (atlas_data == roi['label']).astype(np.uint8)
+	# Select only the spmT values that are inside the ROI masks
+	spmT_rois = {name: spmT_data[voxels] for name, voxels in roi_voxels.items()}
 
-		# Select only the spmT values that are inside the ROI masks
-		spmT_roi = mask[spmT_data]
+	# Create directory
+	os.makedirs(out_dir, exist_ok = True)
 
-		# Save in array for plotting
-		spmT[name] = spmT_roi
+	for name, voxels in roi_voxels.items():
 
-		# Create directory
-		os.makedirs(out_dir, exist_ok = True)
+		result_data = np.zeros(spmT_img.shape, dtype = np.float32)
+		result_data.flat[voxels] = spmT_rois[name]
 
 		# Save result as nifti
 		result_filename = f"sub-{subID:02d}_ses-{sesID:02d}_acq-{acqID}_roi-{name}.nii.gz"
 		result_path 	= os.path.join(out_dir, result_filename)
-		result_img  	= nib.Nifti1Image(spmT_roi, template_img.affine, header = spmT_img.header)
+		result_img  	= nib.Nifti1Image(result_data, template_img.affine, header = spmT_img.header)
 		nib.save(result_img, result_path)
 	
 	return spmT_rois
 
+def discover_maps(results_dir, pattern = "spmT_*_trans_out.nii.gz"):
+	'''
+	Find all first-level result maps in results_dir (sub-XX/ses-XX/acq-XXX/<pattern>).
+
+	Returns:
+	- maps: pandas DataFrame with the subject, session, acqID, map name and path of every map
+	'''
+	paths = sorted(glob.glob(os.path.join(results_dir, "sub-*", "ses-*", "acq-*", pattern)))
+	rows  = []
+	for path in paths:
+		sub, ses, acq = re.search(r"sub-(\w+?)/ses-(\w+?)/acq-(\w+?)/", path).groups()
+		rows.append({'subject': sub, 'session': ses, 'acqID': acq,
+					 'map': os.path.basename(path).split(".")[0], 'path': path})
+	return pd.DataFrame(rows, columns = ['subject', 'session', 'acqID', 'map', 'path'])
+
+# Atlas index of each worker process, loaded once by _init_worker
+_worker_index = None
+
+def _init_worker(index_path):
+	global _worker_index
+	_worker_index = load_roi_index(index_path)
+
+def _extract_map(path, rois):
+	roi_values = gather_roi_values(path, _worker_index, [roi['label'] for roi in rois.values()])
+	return [{'ROI': name, **summarize_roi(roi_values[roi['label']])} for name, roi in rois.items()]
+
+def extract_all(results_dir, index_path, rois, out_path, pattern = "spmT_*_trans_out.nii.gz", n_procs = None):
+	'''
+	Extracts ROI summaries from all first-level maps of all subjects, sessions and acquisitions.
+	Maps are processed over a process pool; every worker loads the atlas index once.
+
+	Parameters:
+	- results_dir: string, folder with the 1st level results (results/1stLevel)
+	- index_path: string, atlas index written by save_roi_index()
+	- rois: dictionary, specifying names, volume and atlas label of target ROIs.
+	- out_path: string, path of the consolidated result table (.tsv)
+	- pattern: string, file name pattern of the maps to extract
+	- n_procs: integer number of worker processes; all CPUs if None
+
+	Returns:
+	- summary: pandas DataFrame, one row per map and ROI
+	'''
+	maps = discover_maps(results_dir, pattern)
+	if maps.empty:
+		print(f"No maps matching {pattern} found in {results_dir} ! :()")
+		return maps
+
+	with ProcessPoolExecutor(max_workers = n_procs, initializer = _init_worker,
+							 initargs = (index_path,)) as pool:
+		results = list(pool.map(_extract_map, maps['path'], itertools.repeat(rois)))
+
+	rows = [{**info, **roi_row}
+			for info, roi_rows in zip(maps.drop(columns = 'path').to_dict('records'), results)
+			for roi_row in roi_rows]
+	summary = pd.DataFrame(rows)
+
+	os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok = True)
+	summary.to_csv(out_path, sep = '\t', index = False)
+
+	return summary
+
 # def plot_violins(mask_paths, subID, sesID, acqID_list, out_dir):
 # 	rows = []
 # 	for mask_path in mask_paths:
@@ -116,75 +360,37 @@ def extract_roi_array(subID, sesID, acqID, atlas, template, spmT, rois, out_dir)
 # RUN FUNCTIONS
 # -----------------------------------------------------------------------------
 
-subID = 4
-sesID = 1
-
-if subID == 1:
-	acqID_list = ["DresdenNoFat", "DresdenWFat", "ME1TR880", "ME3TR1600", 
-				  "ME3TR1100", "ME3TR850", "ME3TR700"]
-elif subID == 2:
-	acqID_list = ["DresdenNoFat", "DresdenWFat", "ME1TR880", "ME3TR1600"]
-elif subID == 3:
-	if sesID == 1:
-		acqID_list = ["DresdenNoFat", "DresdenWFat", "ME1TR880", "ME3TR1600",
-					  "ME3TR1100", "ME3TR850", "ME3TR700"]
-	else:
-		acqID_list = ["DresdenNoFat175", "DresdenWFat175", "ME1TR780", 
-					  "ME3TR1180", "ME3TR770", "ME3TR680"]
-else:
-	if sesID == 1:
-		acqID_list = ["DresdenNoFat", "DresdenWFat", "ME1TR880"]
-	else:
-		acqID_list = ["ME3TR1600", "ME3TR1100", "ME3TR850", "ME3TR700", 
-					  "DresdenNoFat175", "DresdenWFat175",
-  					  "ME1TR780", "ME3TR1180", "ME3TR770", "ME3TR680"]
+if __name__ == "__main__":
 
-# Define ROIs
-# Size represents the volume (mm3) of auditory subcortical structures obtained
-# in their in-vivo functional clusters. See Table 1 in Sitek et al. (2019).
-# Label is identified from plotting unique atlas values in freeview.
-rois = {'IC-L'  : {'size': 146, 'label': 5},
-		'IC-R'  : {'size': 146, 'label': 6},
-		'MGB-L' : {'size': 152, 'label': 7},
-		'MGB-R' : {'size': 152, 'label': 8}}
+	rois = ROIS
 
+	homePath   = "/home/mutrosa/Documents/projects/localizer_fMRI"
+	atlas_path = homePath + f"/templates/atlas/invivo_resampled_to-MNI_res-01.nii.gz"
+	index_path = homePath + f"/templates/atlas/invivo_resampled_to-MNI_res-01_rois.npz"
+	MNI_path   = homePath + "/templates/tpl-MNI152NLin2009cAsym_res-01_T1w.nii.gz"
+	out_dir    = homePath + "/results/ROI"
 
-homePath   = "/home/mutrosa/Documents/projects/localizer_fMRI"
-atlas_path = homePath + f"/templates/atlas/invivo_resampled_to-MNI_res-01.nii.gz"
-MNI_path   = homePath + "/templates/tpl-MNI152NLin2009cAsym_res-01_T1w.nii.gz"
-spmT_path  = homePath + f"/results/1stLevel/sub-{subID:02d}/ses-{sesID:02d}/acq-{acqID}/spmT_0001_trans_out.nii.gz"
+	# Index the atlas labels once (the dense atlas is not scanned again until it changes)
+	roi_index = update_roi_index(atlas_path, index_path)
 
-mask_paths = []
-for acqID in acqID_list:
-	for key, roi in rois.items():
-		mask_path = extract_roi__MNI(key, roi['path'], roi['size'], 
-										acqID, subID, sesID, tmp_dir)
-		mask_paths.append(mask_path)
+	# Extract all ROIs of all subjects, sessions and acquisitions found in results/1stLevel
+	summary = extract_all(homePath + "/results/1stLevel", index_path, rois,
+						  os.path.join(out_dir, "roi-summary.tsv"))
 
-# Plotting
-plot_violins(mask_paths, subID, sesID, acqID_list, tmp_dir)# Prerequisites
-import nibabel as nib
-import numpy as np
-import os
-
-# Create folder to store masks
-out_fold   = "rois"
-out_dir    = os.makedirs(out_fold, exist_ok=True)
-
-# Load atlas image
-atlas_img  = nib.load(atlas_path)
-atlas_data = atlas_img.get_fdata()
-affine     = atlas_img.affine
-
-# Link atlas labels to target ROIs
-label_dict = {"IC-R":  5,
-              "IC-L":  6,
-              "MGB-R": 7,
-              "MGB-L": 8}
-
-# Extract masks for target ROIs
-for name, label in label_dict.items():
-    mask = (atlas_data == label).astype(np.uint8)
-    out_file = f"{name}.nii.gz"
-    nib.save(nib.Nifti1Image(mask, affine), f"{out_fold}/{out_file}")
-    print(f"Saved {out_file}")
\ No newline at end of file
+	# Create folder to store masks
+	out_fold   = "rois"
+	os.makedirs(out_fold, exist_ok=True)
+
+	# Link atlas labels to target ROIs
+	label_dict = {"IC-R":  5,
+				  "IC-L":  6,
+				  "MGB-R": 7,
+				  "MGB-L": 8}
+
+	# Extract masks for target ROIs from the atlas index
+	for name, label in label_dict.items():
+		mask = np.zeros(roi_index['shape'], dtype=np.uint8)
+		mask.flat[roi_index['labels'][label]['voxels']] = 1
+		out_file = f"{name}.nii.gz"
+		nib.save(nib.Nifti1Image(mask, roi_index['affine']), f"{out_fold}/{out_file}")
+		print(f"Saved {out_file}")
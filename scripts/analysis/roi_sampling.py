@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+# -----------------------------------------------------------------------------
+# Sample first-level maps at the atlas ROI voxels instead of warping full maps
+# to MNI. The MNI coordinates of the ROI voxels are pushed once per subject
+# through the same transform the warper node uses (T1w -> MNI, fMRIprep .h5),
+# and every stat map is then interpolated at those coordinates.
+# -----------------------------------------------------------------------------
+
+# Import python packages
+import os, glob, hashlib, re
+import pandas as pd
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import map_coordinates
+from nipype.interfaces import ants
+
+# Import custom-made functions
+import grabber
+from roi_extraction import load_roi_index, summarize_roi, update_roi_index, ROIS
+
+# -----------------------------------------------------------------------------
+# DEFINE FUNCTIONS
+# -----------------------------------------------------------------------------
+def label_digest(index, label):
+	'''
+	Hash of the atlas grid and the voxels of one ROI label, to tell whether cached
+	coordinates were computed from the current atlas index.
+	'''
+	digest = hashlib.sha1(np.asarray(index['shape'], dtype = np.int64).tobytes())
+	digest.update(np.asarray(index['affine'], dtype = np.float64).tobytes())
+	digest.update(np.asarray(index['labels'][label]['voxels'], dtype = np.int64).tobytes())
+	return digest.hexdigest()
+
+def roi_coordinates(index, labels, transform, out_path):
+	'''
+	Map the atlas ROI voxels (MNI) to the native space of a subject, once.
+	ANTs transforms points in the direction opposite to images, so the transform that
+	warps a native image to MNI maps MNI points to native points. The coordinates are
+	recomputed when the transform or the ROI voxels of the index changed.
+
+	Parameters:
+	- index: dictionary, atlas index (see roi_extraction.index_atlas)
+	- labels: list of atlas labels to map
+	- transform: string, T1w -> MNI transform (fMRIprep .h5)
+	- out_path: string, .npz file where the coordinates are kept
+
+	Returns:
+	- coords: dictionary, {label: array (voxels x 3) of native world coordinates (RAS, mm)}
+	'''
+	if os.path.exists(out_path) and os.path.getmtime(out_path) > os.path.getmtime(transform):
+		with np.load(out_path) as f:
+			cached  = {int(key.split('_')[1]): f[key] for key in f.files if key.startswith('label_')}
+			digests = {int(key.split('_')[1]): str(f[key]) for key in f.files if key.startswith('digest_')}
+		if all(label in cached and digests.get(label) == label_digest(index, label) for label in labels):
+			return {label: cached[label] for label in labels}
+		print(f"The atlas ROIs changed since {out_path} was written, mapping them again.")
+
+	# World coordinates (RAS) of the ROI voxels in the atlas
+	voxels = [index['labels'][label]['voxels'] for label in labels]
+	ijk    = np.array(np.unravel_index(np.concatenate(voxels), index['shape']))
+	ras    = (index['affine'] @ np.vstack([ijk, np.ones(ijk.shape[1])]))[:3].T
+
+	# ANTs works in LPS coordinates
+	points_in  = out_path.replace(".npz", "_mni.csv")
+	points_out = out_path.replace(".npz", "_native.csv")
+	lps = ras * [-1, -1, 1]
+	pd.DataFrame({'x': lps[:, 0], 'y': lps[:, 1], 'z': lps[:, 2], 't': 0}).to_csv(points_in, index = False)
+
+	ants.ApplyTransformsToPoints(dimension = 3, input_file = points_in, transforms = [transform],
+								 invert_transform_flags = [False], output_file = points_out).run()
+	native = pd.read_csv(points_out)[['x', 'y', 'z']].to_numpy() * [-1, -1, 1]
+	os.remove(points_in)
+	os.remove(points_out)
+
+	coords = dict(zip(labels, np.split(native, np.cumsum([v.size for v in voxels])[:-1])))
+	np.savez(out_path, **{f"label_{label}": xyz for label, xyz in coords.items()},
+			 **{f"digest_{label}": label_digest(index, label) for label in labels})
+
+	return coords
+
+def sample_map(img, coords, order = 1):
+	'''
+	Interpolate an image at world coordinates (linear by default, as the warper node).
+	Only the bounding box around the coordinates is read from disk.
+
+	Parameters:
+	- img: string (path) or nibabel image
+	- coords: dictionary, {label: array (voxels x 3) of world coordinates (RAS, mm)}
+	- order: integer, spline order (0: nearest, 1: linear)
+
+	Returns:
+	- values: dictionary, {label: array of values}
+	'''
+	img = nib.load(img) if isinstance(img, str) else img
+	xyz = np.concatenate(list(coords.values()))
+	ijk = (np.linalg.inv(img.affine) @ np.vstack([xyz.T, np.ones(len(xyz))]))[:3]
+
+	lo    = np.clip(np.floor(ijk.min(axis = 1)).astype(int) - 1, 0, None)
+	hi    = np.minimum(np.ceil(ijk.max(axis = 1)).astype(int) + 2, img.shape[:3])
+	block = np.asanyarray(img.dataobj[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]], dtype = np.float64)
+
+	values = map_coordinates(np.nan_to_num(block), ijk - lo[:, None], order = order, mode = 'constant', cval = 0)
+	return dict(zip(coords, np.split(values, np.cumsum([len(c) for c in coords.values()])[:-1])))
+
+def sample_all(homePath, index_path, rois, out_path, pattern = "spmT_*.nii"):
+	'''
+	Sample all unwarped first-level maps in results/1stLevel at the atlas ROIs.
+	The ROI coordinates are computed once per subject and reused for all sessions,
+	acquisitions and contrasts.
+
+	Parameters:
+	- homePath: string, project folder
+	- index_path: string, atlas index written by roi_extraction.save_roi_index()
+	- rois: dictionary, specifying names, volume and atlas label of target ROIs.
+	- out_path: string, path of the result table (.tsv)
+	- pattern: string, file name pattern of the native-space maps
+
+	Returns:
+	- summary: pandas DataFrame, one row per map and ROI
+	'''
+	index     = load_roi_index(index_path)
+	labels    = [roi['label'] for roi in rois.values()]
+	mriLayout = grabber.get_layout(f"{homePath}/data_MRI/", derivatives = True)
+	coord_dir = os.path.join(os.path.dirname(os.path.abspath(out_path)), "coords")
+	os.makedirs(coord_dir, exist_ok = True)
+
+	rows = []
+	for path in sorted(glob.glob(os.path.join(homePath, "results", "1stLevel", "sub-*", "ses-*", "acq-*", pattern))):
+		sub, ses, acq = re.search(r"sub-(\w+?)/ses-(\w+?)/acq-(\w+?)/", path).groups()
+
+		# Anatomical files were only collected in ses-01 (see objects_v02)
+		xfms = grabber.grab_BIDS_table(mriLayout, subject = sub, session = "01", suffix = "xfm", extension = "h5")
+		xfm  = [x for x in xfms['path'] if "from-T1w_to-MNI152NLin2009cAsym" in x][0]
+
+		coords = roi_coordinates(index, labels, xfm, os.path.join(coord_dir, f"sub-{sub}_roi-coords.npz"))
+		values = sample_map(path, coords)
+
+		for name, roi in rois.items():
+			rows.append({'subject': sub, 'session': ses, 'acqID': acq, 'map': os.path.basename(path).split(".")[0],
+						 'ROI': name, **summarize_roi(values[roi['label']])})
+
+	summary = pd.DataFrame(rows)
+	summary.to_csv(out_path, sep = '\t', index = False)
+
+	return summary
+
+# -----------------------------------------------------------------------------
+# RUN FUNCTIONS
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+
+	# ROIs of Sitek's atlas (see roi_extraction.py)
+	rois = ROIS
+
+	homePath   = "/home/mutrosa/Documents/projects/localizer_fMRI"
+	atlas_path = homePath + "/templates/atlas/invivo_resampled_to-MNI_res-01.nii.gz"
+	index_path = homePath + "/templates/atlas/invivo_resampled_to-MNI_res-01_rois.npz"
+
+	update_roi_index(atlas_path, index_path)
+	sample_all(homePath, index_path, rois, homePath + "/results/ROI/roi-sampled-summary.tsv")
@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+# -----------------------------------------------------------------------------
+# Temporal signal-to-noise ratio (tSNR) of the preprocessed BOLD series, to
+# compare the subcortical signal of the functional sequences.
+# tSNR = mean over time / standard deviation over time, per voxel.
+# -----------------------------------------------------------------------------
+
+# Import python packages
+from concurrent.futures import ProcessPoolExecutor
+import os, itertools
+import pandas as pd
+import numpy as np
+import nibabel as nib
+
+# Import custom-made functions
+import grabber
+from resampler import resample_cached
+from roi_extraction import group_atlas_voxels, summarize_roi, ROIS
+
+# -----------------------------------------------------------------------------
+# DEFINE FUNCTIONS
+# -----------------------------------------------------------------------------
+def running_moments(bold, chunk_size = 32):
+	'''
+	Voxelwise mean and variance over time, reading chunk_size volumes at a time.
+	Chunks are merged with the parallel form of Welford's algorithm (Chan et al., 1979),
+	so memory does not grow with the number of volumes. The file is kept open, so that
+	each chunk of a .nii.gz continues the decompression where the previous one stopped.
+
+	Parameters:
+	- bold: string (path) or nibabel image, 4D BOLD series
+	- chunk_size: integer number of volumes held in memory at once
+
+	Returns:
+	- mean: numpy array (3D), mean over time
+	- var: numpy array (3D), unbiased variance over time
+	'''
+	img = nib.load(bold, keep_file_open = True) if isinstance(bold, str) else bold
+	n_vols = img.shape[3]
+
+	count = 0
+	mean  = np.zeros(img.shape[:3], dtype = np.float64)
+	M2    = np.zeros(img.shape[:3], dtype = np.float64)
+	for start in range(0, n_vols, chunk_size):
+		chunk = np.asanyarray(img.dataobj[..., start:start + chunk_size], dtype = np.float64)
+		n     = chunk.shape[3]
+		chunk_mean  = chunk.mean(axis = 3)
+		chunk_M2    = ((chunk - chunk_mean[..., None]) ** 2).sum(axis = 3)
+
+		delta = chunk_mean - mean
+		total = count + n
+		mean += delta * n / total
+		M2   += chunk_M2 + delta ** 2 * count * n / total
+		count = total
+
+	var = M2 / (count - 1) if count > 1 else np.zeros_like(M2)
+	return mean, var
+
+def compute_tsnr(bold, mask = None, chunk_size = 32):
+	'''
+	Voxelwise tSNR of a BOLD series, streamed in chunks of volumes (see running_moments).
+
+	Parameters:
+	- bold: string (path) or nibabel image, 4D BOLD series
+	- mask: string (path) to a brain mask in the same space; voxels outside are set to 0
+	- chunk_size: integer number of volumes held in memory at once
+
+	Returns:
+	- tsnr_img: nibabel image (3D, float32)
+	'''
+	img = nib.load(bold, keep_file_open = True) if isinstance(bold, str) else bold
+	mean, var = running_moments(img, chunk_size)
+
+	std  = np.sqrt(var)
+	tsnr = np.divide(mean, std, out = np.zeros_like(mean), where = std > 0)
+	if mask:
+		tsnr[np.asanyarray(nib.load(mask).dataobj) == 0] = 0
+
+	return nib.Nifti1Image(tsnr.astype(np.float32), img.affine)
+
+def roi_voxels_per_grid(atlas_path, bold_paths, rois):
+	'''
+	Resample the atlas (label-preserving, cached) once per distinct grid of the BOLD runs
+	and find the voxels of the ROIs on each grid. Runs sharing an affine and shape share
+	the result, so the large atlas is resampled and hashed once per grid, not once per run.
+
+	Parameters:
+	- atlas_path: string, label atlas in MNI space
+	- bold_paths: list of strings, BOLD runs (only their headers are read)
+	- rois: dictionary, specifying names, volume and atlas label of target ROIs.
+
+	Returns:
+	- roi_voxels: list of dictionaries (one per run), flat voxel indices per ROI
+	'''
+	grids, roi_voxels = {}, []
+	for bold_path in bold_paths:
+		img = nib.load(bold_path)
+		key = (tuple(img.shape[:3]), np.round(img.affine, 6).tobytes())
+		if key not in grids:
+			grid_img   = nib.Nifti1Image(np.zeros(img.shape[:3], dtype = np.uint8), img.affine)
+			atlas_img  = resample_cached(atlas_path, grid_img, interpolation = 'label')
+			grids[key] = group_atlas_voxels(np.asanyarray(atlas_img.dataobj), rois)
+		roi_voxels.append(grids[key])
+	return roi_voxels
+
+def run_tsnr(bold_path, mask_path, out_prefix, roi_voxels, chunk_size = 32):
+	'''
+	Compute and save the tSNR map of one run, and summarize it in the ROIs.
+
+	Parameters:
+	- roi_voxels: dictionary, flat voxel indices per ROI on the grid of the run (see roi_voxels_per_grid)
+
+	Returns:
+	- rows: list of dictionaries, tSNR summary per ROI
+	'''
+	tsnr_img = compute_tsnr(bold_path, mask_path, chunk_size)
+	tsnr_img.to_filename(f"{out_prefix}_desc-tsnr.nii.gz")
+
+	tsnr_data = np.asanyarray(tsnr_img.dataobj).ravel()
+
+	return [{'ROI': name, **summarize_roi(tsnr_data[voxels])} for name, voxels in roi_voxels.items()]
+
+def tsnr_batch(homePath, atlas_path, rois, out_dir, subjects = None, sessions = None,
+			   acquisitions = None, chunk_size = 32, n_procs = None):
+	'''
+	Compute tSNR maps and ROI summaries for all preprocessed runs found in data_MRI/derivatives.
+	The atlas is resampled to the grids of the runs beforehand (once per grid); runs are then
+	processed over a process pool and one consolidated table is written to out_dir.
+
+	Parameters:
+	- homePath: string, project folder
+	- atlas_path: string, label atlas in MNI space (Sitek)
+	- rois: dictionary, specifying names, volume and atlas label of target ROIs.
+	- out_dir: string, folder for the tSNR maps and the table
+	- subjects, sessions: lists of integer IDs; all if None
+	- acquisitions: list of acquisition labels; all if None
+	- chunk_size: integer number of volumes held in memory at once, per worker
+	- n_procs: integer number of worker processes; all CPUs if None
+
+	Returns:
+	- summary: pandas DataFrame, tSNR summary per run and ROI
+	'''
+	layout   = grabber.get_layout(f"{homePath}/data_MRI/", derivatives = True)
+	entities = dict(subject = subjects, session = sessions, acquisition = acquisitions,
+					space = "MNI152NLin2009cAsym", extension = "nii.gz")
+	bolds    = grabber.grab_BIDS_table(layout, suffix = "bold", desc = "preproc", **entities)
+	masks    = grabber.grab_BIDS_table(layout, suffix = "mask", desc = "brain", datatype = "func", **entities)
+	if bolds.empty:
+		print(f"No preprocessed BOLD found in {homePath}/data_MRI/derivatives ! :()")
+		return bolds
+
+	runs = bolds.merge(masks[['subject', 'session', 'acquisition', 'path']], how = 'left',
+					   on = ['subject', 'session', 'acquisition'], suffixes = ('', '_mask'))
+
+	os.makedirs(out_dir, exist_ok = True)
+	prefixes = [os.path.join(out_dir, f"sub-{run.subject}_ses-{run.session}_acq-{run.acquisition}")
+				for run in runs.itertuples()]
+
+	roi_voxels = roi_voxels_per_grid(atlas_path, runs['path'], rois)
+
+	with ProcessPoolExecutor(max_workers = n_procs) as pool:
+		results = list(pool.map(run_tsnr, runs['path'],
+								[mask if isinstance(mask, str) else None for mask in runs['path_mask']], prefixes,
+								roi_voxels, itertools.repeat(chunk_size)))
+
+	rows = [{'subject': run.subject, 'session': run.session, 'acqID': run.acquisition, **roi_row}
+			for run, roi_rows in zip(runs.itertuples(), results)
+			for roi_row in roi_rows]
+	summary = pd.DataFrame(rows)
+	summary.to_csv(os.path.join(out_dir, "tsnr-summary.tsv"), sep = '\t', index = False)
+
+	return summary
+
+# -----------------------------------------------------------------------------
+# RUN FUNCTIONS
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+
+	# ROIs of Sitek's atlas (see roi_extraction.py)
+	rois = ROIS
+
+	homePath   = "/home/mutrosa/Documents/projects/localizer_fMRI"
+	atlas_path = homePath + "/templates/atlas/sub-invivo_MNI_rois.nii.gz"
+	out_dir    = homePath + "/results/tSNR"
+
+	summary = tsnr_batch(homePath, atlas_path, rois, out_dir)
+	print(summary.groupby(['acqID', 'ROI'])['mean'].mean().unstack())
@@ -101,11 +101,11 @@ print("shape ROI:",           ROI_image.shape)
 # plot_after.savefig(f"stat_map_sub-{subID:02d}_ses-{sesID:02d}_acq-{acqID}_after_warper.png")
 
 # # Resample to match Sitek's atlas
-from nilearn.image import resample_to_img
-resampled_spmT = resample_to_img(spmT_image_after, atlas_image, interpolation='nearest',  copy_header=True, force_resample=True)
+from resampler import resample_cached
+resampled_spmT = resample_cached(spmT_path_after, atlas_image, interpolation='nearest')
 resampled_spmT.to_filename("resampled_spmT.nii.gz")
 
-resampled_MNI = resample_to_img(MNI_image, atlas_image, interpolation='nearest', copy_header=True, force_resample=True)
+resampled_MNI = resample_cached(MNI_path, atlas_image, interpolation='nearest')
 resampled_MNI.to_filename("resampled_MNI.nii.gz")
 
 # # check affines / sform / qform
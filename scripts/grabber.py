@@ -1,7 +1,107 @@
 #! /usr/bin/env python
 # Time-stamp: <2025-15-07 m.utrosa@bcbl.eu>
 
-import bids
+import bids, fcntl, hashlib, os, re, sqlite3
+from contextlib import contextmanager
+
+# Folder holding the persistent layout indexes. Override with $BIDS_LAYOUT_CACHE.
+LAYOUT_CACHE = os.environ.get("BIDS_LAYOUT_CACHE",
+							  os.path.join(os.path.expanduser("~"), ".cache", "bids_layouts"))
+
+# Folders left out of every index (the folders pybids ignores by default, plus the
+# temporary folder dcm2bids creates in the output folder). Hidden files and folders are
+# ignored as well.
+LAYOUT_IGNORE = ["code", "stimuli", "sourcedata", "models", "derivatives", "tmp_dcm2bids"]
+
+def _tree_signature(rootpath, ignore=LAYOUT_IGNORE):
+	"""
+	Hash the names of all files and folders in a tree, leaving out what the index ignores
+	(top-level folders in ignore, hidden files and folders). Adding, removing or renaming
+	a file changes the hash; creating or deleting an ignored folder does not.
+	"""
+	digest = hashlib.sha1()
+	for dirpath, dirnames, filenames in os.walk(rootpath):
+		dirnames[:] = sorted(d for d in dirnames if not d.startswith('.')
+							 and not (dirpath == rootpath and d in ignore))
+		filenames   = sorted(f for f in filenames if not f.startswith('.'))
+		digest.update(f"{os.path.relpath(dirpath, rootpath)}:{'/'.join(dirnames)}:{'/'.join(filenames)};".encode())
+	return digest.hexdigest()
+
+@contextmanager
+def _locked(lockPath):
+	"""Hold an exclusive lock on lockPath, so that only one process builds an index at a time."""
+	with open(lockPath, 'a') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _registry(cache_dir):
+	"""Open the table that stores the signature of every indexed tree."""
+	db = sqlite3.connect(os.path.join(cache_dir, "registry.sqlite"), timeout=60)
+	db.execute("CREATE TABLE IF NOT EXISTS layouts (root TEXT PRIMARY KEY, signature TEXT)")
+	return db
+
+def _index_tree(cache_dir, rootpath, build):
+	"""
+	Call build(reset) with reset=True if the tree changed since it was last indexed,
+	and store the new signature once the index has been built. Callers hold the lock
+	of the layout (see get_layout).
+	"""
+	signature = _tree_signature(rootpath)
+	with _registry(cache_dir) as db:
+		stored = db.execute("SELECT signature FROM layouts WHERE root = ?", (rootpath,)).fetchone()
+	result = build(reset = not stored or stored[0] != signature)
+	with _registry(cache_dir) as db:
+		db.execute("INSERT OR REPLACE INTO layouts VALUES (?, ?)", (rootpath, signature))
+	return result
+
+def get_layout(filepath, derivatives=False, cache_dir=LAYOUT_CACHE):
+	"""
+	Build a BIDSLayout backed by a persistent SQLite index, so that repeated calls
+	(from any script or process) do not re-walk the whole tree.
+
+	The raw tree and every derivatives pipeline (e.g. fMRIprep) get their own index.
+	Each index is rebuilt only if files were added, removed or renamed in its subtree
+	since it was created. Files edited in place (same name) do not invalidate the index.
+	Checking and rebuilding the indexes is serialized across processes with a lock file.
+
+	Parameters:
+		filepath    (str)  : the path to the BIDS-compliant data folder
+		derivatives (bool) : also index the pipelines in filepath/derivatives
+		cache_dir   (str)  : folder where the SQLite indexes are stored
+
+	Returns:
+		a BIDSLayout object
+	"""
+	rootpath  = os.path.abspath(filepath)
+	derivPath = os.path.join(rootpath, "derivatives")
+	dbPath    = os.path.join(cache_dir, hashlib.sha1(rootpath.encode()).hexdigest()[:16])
+	os.makedirs(cache_dir, exist_ok=True)
+
+	ignore    = LAYOUT_IGNORE + [re.compile(r'^\.')]
+
+	with _locked(f"{dbPath}.lock"):
+		# Raw data
+		layout = _index_tree(cache_dir, rootpath, lambda reset:
+							 bids.layout.BIDSLayout(rootpath, validate=False, database_path=dbPath,
+													reset_database=reset, ignore=ignore))
+
+		# Derivatives: either a single pipeline folder or one folder per pipeline
+		if derivatives and os.path.isdir(derivPath):
+			if os.path.exists(os.path.join(derivPath, "dataset_description.json")):
+				pipelines = [derivPath]
+			else:
+				pipelines = [os.path.join(derivPath, d) for d in sorted(os.listdir(derivPath))
+							 if os.path.exists(os.path.join(derivPath, d, "dataset_description.json"))]
+
+			for pipeline in pipelines:
+				_index_tree(cache_dir, pipeline, lambda reset:
+							layout.add_derivatives(pipeline, parent_database_path=dbPath,
+												   validate=False, reset_database=reset))
+
+	return layout
 
 def define_grabconf(subject, session, suffix, extension, **kwargs):
 	"""
@@ -72,4 +172,39 @@ def grab_BIDS_object(filepath, layout, grabconf):
 	# Get filepaths
 	target_BIDSobjects = layout.get(**filters)
 
-	return target_BIDSobjects
\ No newline at end of file
+	return target_BIDSobjects
+
+def grab_BIDS_table(layout, **entities):
+	"""
+	Use BIDSLayout to find BIDS objects matching many entity values at once.
+	Every entity accepts a single value or a list of values, e.g.
+	grab_BIDS_table(layout, subject=[1, 2], session=1, suffix="bold",
+					acquisition=["DresdenNoFat", "ME1TR880"], space="MNI152NLin2009cAsym")
+
+	Parameters:
+		layout     (class) : the output of BIDSLayout
+		**entities         : BIDS entities (subject, session, acquisition, suffix, extension, space, ...)
+							 subjects and sessions can be given as integers
+
+	Returns:
+		a pandas DataFrame with one row per file: the path and its entities as columns
+	"""
+	import pandas as pd
+
+	# Lists are turned into a single IN query over the index.
+	filters = {}
+	for key, value in entities.items():
+		if value is None:
+			continue
+		values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+		if key in ('subject', 'session'):
+			values = [f"{v:02d}" if isinstance(v, int) else v for v in values]
+		filters[key] = values
+
+	target_BIDSobjects = layout.get(return_type='object', **filters)
+	table = pd.DataFrame([{'path': obj.path, **obj.get_entities()} for obj in target_BIDSobjects])
+	if table.empty:
+		return pd.DataFrame(columns=['path'] + list(entities))
+
+	sort_keys = [key for key in ('subject', 'session', 'acquisition', 'suffix') if key in table]
+	return table.sort_values(sort_keys + ['path']).reset_index(drop=True)
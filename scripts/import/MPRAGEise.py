@@ -7,10 +7,12 @@ the bias field and then “MPRAGEises” the UNI image.
 
 Usage:
     MPRAGEise.py -i INV2_image -u UNI_image [-r re_bias] [-o output_folder] [-v]
+    python -m scripts.import.MPRAGEise --batch BIDS_folder [--subjects 1 2 ...] [--session 1] [-j n_jobs]
 
 Examples:
     MPRAGEise.py -i /path/to/data/inv2.nii.gz -u /data/uni.nii.gz
     MPRAGEise.py -i /path/to/data/inv2+orig -u /path/to/data/uni+orig -r 1
+    python -m scripts.import.MPRAGEise --batch /path/to/data_MRI/sourcedata/raw -j 8
 
 Created by: Sriranga Kashyap (01-2025), srikashmri@gmail.com
 Source: https://github.com/srikash/MPRAGEise
@@ -22,6 +24,9 @@ import argparse
 import subprocess
 import datetime
 import glob
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # Set AFNI environment variables
 os.environ["AFNI_NIFTI_TYPE_WARN"] = "NO"
@@ -59,10 +64,18 @@ def parse_arguments():
         epilog=epilog_text,
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument("-i", "--inv2", required=True,
+    parser.add_argument("-i", "--inv2",
                         help="MP2RAGE INV2 image (e.g. /path/to/inv2.nii.gz or file+orig)")
-    parser.add_argument("-u", "--uni", required=True,
+    parser.add_argument("-u", "--uni",
                         help="MP2RAGE UNI image (e.g. /path/to/uni.nii.gz or uni+orig)")
+    parser.add_argument("--batch", default=None,
+                        help="BIDS folder: MPRAGEise all INV2/UNI pairs found in it instead of -i/-u.")
+    parser.add_argument("--subjects", type=int, nargs="+", default=None,
+                        help="Subjects processed with --batch (default: all).")
+    parser.add_argument("--session", type=int, default=1,
+                        help="Session processed with --batch (default=1).")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="Number of subjects processed at the same time with --batch (default=4).")
     parser.add_argument("-r", "--re_bias", default="0",
                         help="Reintroduce bias-field (default=0, optional).")
     parser.add_argument("-o", "--output", default=None,
@@ -71,7 +84,10 @@ def parse_arguments():
                         help="Include -overwrite flag in each AFNI command.")
     parser.add_argument("-v", "--verbose", action="store_true", default=False,
                         help="Enable verbose logging of command execution and debug information.")
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.batch is None and (args.inv2 is None or args.uni is None):
+        parser.error("the arguments -i/--inv2 and -u/--uni are required (or use --batch)")
+    return args
 
 def get_basename_and_extension(filename):
     """
@@ -140,6 +156,123 @@ def cleanup_temp_files(prefix):
             except Exception as e:
                 print(f"Warning: Could not remove temporary file {f}: {e}")
 
+def load_volume(filename, unscaled=False):
+    """Load a NIfTI image as float32 (the stored values if unscaled, as 3dinfo -dmaxus/-dminus)."""
+    import nibabel as nib
+    import numpy as np
+
+    img = nib.load(filename)
+    if unscaled and hasattr(img.dataobj, "get_unscaled"):
+        return img, np.asarray(img.dataobj.get_unscaled(), dtype=np.float32)
+    return img, np.asarray(img.dataobj, dtype=np.float32)
+
+def mprageise(inv2_image, uni_image, output_folder, re_bias=False, overwrite=False):
+    """
+    MPRAGEise NIfTI images in memory. INV2 and UNI are loaded once, the INV2 image
+    is normalised to [0, 1] with its own min/max and multiplied with the UNI image
+    (float32). Only the bias-field correction calls out to AFNI (3dUnifize), into a
+    temporary folder that is removed afterwards.
+
+    Returns the path of the MPRAGEised image (<uni_basename>_T1w).
+    """
+    import nibabel as nib
+
+    inv2_basename, file_ext = get_basename_and_extension(inv2_image)
+    uni_basename, _ = get_basename_and_extension(uni_image)
+    out_name = os.path.join(output_folder, f"{uni_basename}_T1w{file_ext}")
+    if os.path.exists(out_name) and not overwrite:
+        raise FileExistsError(f"Output file {out_name} already exists (use --overwrite).")
+
+    # Intensity range of the original INV2 image.
+    inv2_img, inv2 = load_volume(inv2_image, unscaled=True)
+    int_min, int_max = inv2.min(), inv2.max()
+
+    if not re_bias:
+        with tempfile.TemporaryDirectory(dir=output_folder) as tmp_folder:
+            bfc_prefix = os.path.join(tmp_folder, f"{inv2_basename}_bfc.nii")
+            run_command(["3dUnifize", "-quiet", "-prefix", bfc_prefix, inv2_image])
+            _, bfc = load_volume(bfc_prefix)
+    else:
+        _, bfc = load_volume(inv2_image)
+
+    # CALCULATION: Intensity normalization and MPRAGEising.
+    print("\n++++ MPRAGEising the UNI image.")
+    uni_img, uni = load_volume(uni_image)
+    bfc -= int_min
+    bfc /= int_max - int_min
+    uni *= bfc
+
+    header = uni_img.header.copy()
+    header.set_data_dtype("float32")
+    header.set_slope_inter(1, 0)
+    nib.save(nib.Nifti1Image(uni, uni_img.affine, header), out_name)
+
+    return out_name
+
+def find_pairs(bids_folder, subjects=None, session=1):
+    """
+    Find the INV2/UNI pairs of a BIDS folder with grabber.
+
+    Returns a list of (subject, INV2 image, UNI image).
+    """
+    from scripts import grabber
+
+    layout = grabber.get_layout(bids_folder)
+    inv2 = grabber.grab_BIDS_table(layout, subject=subjects, session=session, suffix="MP2RAGE",
+                                   inv=2, extension="nii.gz")
+    uni  = grabber.grab_BIDS_table(layout, subject=subjects, session=session, suffix="UNIT1",
+                                   extension="nii.gz")
+    pairs = inv2.merge(uni, on=["subject", "session"], suffixes=("_inv2", "_uni"))
+    for subject in sorted(set(inv2["subject"]) ^ set(uni["subject"])):
+        print(f"Warning: sub-{subject} does not have both an INV2 and a UNI image, skipping.")
+    return [(row.subject, row.path_inv2, row.path_uni) for row in pairs.itertuples()]
+
+def is_up_to_date(inv2_image, uni_image, output_folder):
+    """True if the MPRAGEised image exists and is newer than both inputs."""
+    uni_basename, file_ext = get_basename_and_extension(uni_image)
+    out_name = os.path.join(output_folder, f"{uni_basename}_T1w{file_ext}")
+    return os.path.exists(out_name) and \
+        os.path.getmtime(out_name) > max(os.path.getmtime(inv2_image), os.path.getmtime(uni_image))
+
+def timed_mprageise(inv2_image, uni_image, output_folder, re_bias=False):
+    """Run mprageise() (overwriting an outdated output) and return the output and the duration."""
+    start = time.time()
+    out_name = mprageise(inv2_image, uni_image, output_folder, re_bias, overwrite=True)
+    return out_name, time.time() - start
+
+def mprageise_batch(pairs, n_jobs=4, re_bias=False):
+    """
+    MPRAGEise many subjects with a pool of n_jobs processes. Outputs are written next to
+    the INV2 images; subjects whose output is newer than their inputs are skipped.
+
+    pairs: list of (subject, INV2 image, UNI image), e.g. from find_pairs()
+    Returns a dictionary {subject: output file, or the exception if it failed}.
+    """
+    results = {}
+    todo = []
+    for subject, inv2_image, uni_image in pairs:
+        if is_up_to_date(inv2_image, uni_image, os.path.dirname(inv2_image)):
+            print(f"sub-{subject}: up to date, skipping.")
+        else:
+            todo.append((subject, inv2_image, uni_image))
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        jobs = {pool.submit(timed_mprageise, inv2_image, uni_image, os.path.dirname(inv2_image), re_bias): subject
+                for subject, inv2_image, uni_image in todo}
+        for job, subject in jobs.items():
+            try:
+                out_name, seconds = job.result()
+                results[subject] = out_name
+                print(f"sub-{subject}: {seconds:.1f} s -> {out_name}")
+            except BaseException as e:
+                results[subject] = e
+                print(f"sub-{subject}: FAILED ({e})")
+
+    print(f"\n++++ MPRAGEised {len(todo)} subject(s) in {time.time() - start:.1f} s "
+          f"({len(pairs) - len(todo)} up to date).")
+    return results
+
 def main():
     global VERBOSE
     args = parse_arguments()
@@ -154,6 +287,11 @@ def main():
     uni_image = args.uni
     re_bias_flag = args.re_bias.strip()
 
+    if args.batch is not None:
+        pairs = find_pairs(args.batch, args.subjects, args.session)
+        results = mprageise_batch(pairs, args.jobs, re_bias_flag != "0")
+        sys.exit(1 if any(isinstance(r, BaseException) for r in results.values()) else 0)
+
     # Print startup information.
     print()  # blank line
     print("------------------------------")
@@ -197,6 +335,17 @@ def main():
         print("\n++++ Removing bias-field.")
         re_bias = False
 
+    # NIfTI inputs are processed in memory; AFNI datasets with AFNI (3dcalc).
+    if file_ext in (".nii", ".nii.gz"):
+        try:
+            out_name = mprageise(inv2_image, uni_image, output_folder, re_bias, args.overwrite)
+        except FileExistsError as e:
+            sys.exit(f"Error: {e}")
+        print("\n++++ Done.\n")
+        print(f"Output file: {out_name}")
+        print()  # blank line
+        return
+
     # Build full output paths using the output folder.
     if not re_bias:
         bfc_prefix = os.path.join(output_folder, f"{inv2_basename}_bfc{file_ext}")
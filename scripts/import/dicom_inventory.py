@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+#
+# Inventory of a DICOM session folder without converting it.
+#
+# Only the headers are read (pixel data are skipped), with a thread pool across
+# all files of all series folders. Files are grouped by SeriesNumber and
+# SeriesDescription, volumes are counted per series (one AcquisitionNumber per
+# volume) and compared to the expected counts. The summary of every folder is
+# cached in <cache_dir>/<session>_<hash of the folder path>.json (the system's
+# temporary folder by default, never the DICOM folder itself) and only folders
+# whose files changed are read again.
+#
+# Usage:
+#	python -m scripts.import.dicom_inventory <dicomFold> [<confFile>] [<cache_dir>]
+
+# Import python packages
+from concurrent.futures import ThreadPoolExecutor
+import hashlib, json, os, sys, tempfile
+import pandas as pd
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+# Header fields kept in the inventory
+TAGS = ["SeriesNumber", "SeriesDescription", "AcquisitionNumber", "InstanceNumber",
+		"RepetitionTime", "EchoTime", "ImageType", "NumberOfFrames"]
+
+def cache_path(dicomFold, cache_dir=None):
+	"""Path of the inventory cache of a DICOM folder, outside of the folder itself."""
+	dicomFold = os.path.abspath(dicomFold)
+	cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "dicom_inventory")
+	digest    = hashlib.sha1(dicomFold.encode()).hexdigest()[:12]
+	return os.path.join(cache_dir, f"{os.path.basename(dicomFold.rstrip(os.sep))}_{digest}.json")
+
+def header_value(ds, tag, cast, default):
+	"""A header field cast to int/float, or default if it is missing, empty or cannot be cast."""
+	value = ds.get(tag, None)
+	if value is None or value == "":
+		return default
+	try:
+		return cast(value)
+	except (TypeError, ValueError):
+		return default
+
+def read_header(path):
+	"""Read the inventory fields of one DICOM file (None if it is not a DICOM file)."""
+	try:
+		ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=TAGS)
+	except (InvalidDicomError, IsADirectoryError, PermissionError):
+		return None
+	return {'SeriesNumber'     : header_value(ds, "SeriesNumber", int, 0),
+			'SeriesDescription': str(ds.get("SeriesDescription", None) or ""),
+			'AcquisitionNumber': header_value(ds, "AcquisitionNumber", int, 0),
+			'InstanceNumber'   : header_value(ds, "InstanceNumber", int, 0),
+			'RepetitionTime'   : header_value(ds, "RepetitionTime", float, 0.0),
+			'EchoTime'         : header_value(ds, "EchoTime", float, 0.0),
+			'ImageType'        : "\\".join(ds.get("ImageType", None) or []),
+			'NumberOfFrames'   : header_value(ds, "NumberOfFrames", int, 0) or 1}
+
+def summarize_folder(paths, pool):
+	"""Group the headers of the files in one folder by series."""
+	series = {}
+	for header in pool.map(read_header, paths):
+		if header is None:
+			continue
+		key = f"{header['SeriesNumber']}|{header['SeriesDescription']}"
+		entry = series.setdefault(key, {'SeriesNumber'     : header['SeriesNumber'],
+										'SeriesDescription': header['SeriesDescription'],
+										'RepetitionTime'   : header['RepetitionTime'],
+										'EchoTime'         : header['EchoTime'],
+										'ImageType'        : header['ImageType'],
+										'n_files'          : 0,
+										'n_frames'         : 0,
+										'acquisitions'     : []})
+		entry['n_files']  += 1
+		entry['n_frames'] += header['NumberOfFrames']
+		entry['acquisitions'].append(header['AcquisitionNumber'])
+	for entry in series.values():
+		entry['acquisitions'] = sorted(set(entry['acquisitions']))
+	return series
+
+def inventory_session(dicomFold, n_threads=16, use_cache=True, cache_dir=None):
+	"""
+	Inventory of all series in a DICOM session folder.
+
+	Arguments:
+		dicomFold (str) : session folder with the DICOM files (any number of subfolders)
+		n_threads (int) : number of threads reading headers
+		use_cache (bool): reuse the summaries of folders that did not change
+		cache_dir (str) : folder of the inventory cache (default: <tmp>/dicom_inventory)
+
+	Returns:
+		a DataFrame with one row per series: SeriesNumber, SeriesDescription, RepetitionTime,
+		EchoTime, ImageType, n_files, n_frames and n_volumes
+	"""
+	cachePath = cache_path(dicomFold, cache_dir)
+	cache = {}
+	if use_cache and os.path.exists(cachePath):
+		with open(cachePath) as f:
+			cache = json.load(f)
+
+	folders = {}
+	with ThreadPoolExecutor(max_workers=n_threads) as pool:
+		for root, dirs, files in os.walk(dicomFold):
+			files = sorted(f for f in files if not f.startswith("."))
+			if not files:
+				continue
+			paths = [os.path.join(root, f) for f in files]
+			stats = [os.stat(p) for p in paths]
+			signature = [len(files), sum(s.st_size for s in stats), max(s.st_mtime_ns for s in stats)]
+
+			folder = os.path.relpath(root, dicomFold)
+			if cache.get(folder, {}).get('signature') == signature:
+				folders[folder] = cache[folder]
+			else:
+				folders[folder] = {'signature': signature, 'series': summarize_folder(paths, pool)}
+
+	os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+	with open(f"{cachePath}.{os.getpid()}", 'w') as f:
+		json.dump(folders, f)
+	os.replace(f"{cachePath}.{os.getpid()}", cachePath)
+
+	# A series may be spread across several folders.
+	series = {}
+	for folder in folders.values():
+		for key, entry in folder['series'].items():
+			if key not in series:
+				series[key] = dict(entry, acquisitions=set(entry['acquisitions']))
+			else:
+				series[key]['n_files']  += entry['n_files']
+				series[key]['n_frames'] += entry['n_frames']
+				series[key]['acquisitions'] |= set(entry['acquisitions'])
+
+	columns = ["SeriesNumber", "SeriesDescription", "RepetitionTime", "EchoTime", "ImageType",
+			   "n_files", "n_frames", "n_volumes"]
+	rows = []
+	for entry in series.values():
+		# Mosaic/multi-frame series: one file (acquisition) per volume. Single-slice series
+		# (e.g. anatomical images) share one acquisition number and count as one volume.
+		entry['n_volumes'] = len(entry.pop('acquisitions'))
+		rows.append(entry)
+	return pd.DataFrame(rows, columns=columns).sort_values("SeriesNumber", ignore_index=True)
+
+def check_session(dicomFold, confFile=None, expected=None, n_threads=16, cache_dir=None):
+	"""
+	Report the series of a session and whether they are complete.
+
+	Arguments:
+		dicomFold (str) : session folder with the DICOM files
+		confFile  (str) : dcm2bids configuration; series it describes but which are missing are reported
+		expected  (dict): {SeriesDescription: expected number of volumes}
+		n_threads (int) : number of threads reading headers
+		cache_dir (str) : folder of the inventory cache (see inventory_session)
+
+	Returns:
+		the inventory with the columns expected and complete
+	"""
+	inventory = inventory_session(dicomFold, n_threads, cache_dir=cache_dir)
+	expected  = expected or {}
+	inventory['expected'] = inventory['SeriesDescription'].map(expected)
+	inventory['complete'] = inventory['expected'].isna() | (inventory['n_volumes'] == inventory['expected'])
+
+	missing = [d for d in expected if d not in set(inventory['SeriesDescription'])]
+	if confFile:
+		with open(confFile) as f:
+			descriptions = json.load(f)['descriptions']
+		missing += [d['criteria']['SeriesDescription'] for d in descriptions
+					if 'SeriesDescription' in d.get('criteria', {})
+					and d['criteria']['SeriesDescription'] not in set(inventory['SeriesDescription'])]
+
+	with pd.option_context('display.max_rows', None, 'display.width', 200):
+		print(inventory.drop(columns=["ImageType"]).to_string(index=False))
+	for description in dict.fromkeys(missing):
+		print(f"MISSING: no series with SeriesDescription {description}")
+	for _, row in inventory[~inventory['complete']].iterrows():
+		print(f"INCOMPLETE: series {row['SeriesNumber']} ({row['SeriesDescription']}) has "
+			  f"{row['n_volumes']} volumes, expected {int(row['expected'])}")
+
+	return inventory
+
+if __name__ == "__main__":
+	check_session(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None,
+				  cache_dir=sys.argv[3] if len(sys.argv) > 3 else None)
@@ -11,7 +11,7 @@
 # scans (dicom numbers) and then replace the "run-{O2d}" with "acq-{sequenceName}".
 
 # Import python packages
-import bids, sys, shutil
+import sys, shutil
 
 # Import custom-made functions
 from scripts import grabber
@@ -22,7 +22,7 @@ def import_LOG(subID, sesID, project, homePath):
 	# 1. LOGFILE data import
 	rawFold   = f'{homePath}/data_logs/bids/' # BIDS-compliant logfiles folder
 	outPath   = f'{homePath}/data_MRI/sourcedata/raw/sub-{subID:02d}/ses-{sesID:02d}/func/'
-	logLayout = bids.layout.BIDSLayout(rawFold, validate=False)
+	logLayout = grabber.get_layout(rawFold)
 	grabconf  = grabber.define_grabconf(subID, sesID, "events", "tsv", task = "localizer")
 	logfiles  = grabber.grab_BIDS_object(rawFold, logLayout, grabconf)
 
@@ -32,7 +32,9 @@ def import_LOG(subID, sesID, project, homePath):
 		for lf in logfiles: 
 			print(f"\nCopying {lf.path} to {outPath}")
 			shutil.copy(lf.path, outPath)
+	return logfiles
 
 if __name__ == "__main__":
     subID, sesID, project, homePath = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3], sys.argv[4]
-    import_LOG(subID, sesID, project, homePath)
\ No newline at end of file
+    if not import_LOG(subID, sesID, project, homePath):
+        sys.exit(1) # nothing was imported, so the scheduler does not mark the session as done
\ No newline at end of file
@@ -20,10 +20,11 @@
 # missing files from PACS.
 
 # Import python packages
-import bioread, os, sys, bids
+import bioread, os, shutil, subprocess, sys
 
 # Import custom-made functions
 from scripts import grabber
+from . import MPRAGEise
 
 def import_MRI(subID, sesID, project, homePath):
 
@@ -34,35 +35,47 @@ def import_MRI(subID, sesID, project, homePath):
 	    os.makedirs(dataPath)
 
 	confFile  = f'{homePath}/scripts/import/conf_{project}.json'
-	options   = f'-d {dicomFold} -p {subID:02d} -s {sesID:02d}'
-	bids_cmd  = f'dcm2bids {options} -c {confFile} -o {dataPath} '
-	print("\nRunning:", bids_cmd)
-	os.system(bids_cmd)
-	os.system(f"rm -r {homePath}/data_MRI/sourcedata/raw/tmp_dcm2bids/") # Remove unnecessary tmp folder
+	bids_cmd  = ['dcm2bids', '-d', dicomFold, '-p', f'{subID:02d}', '-s', f'{sesID:02d}', '-c', confFile, '-o', dataPath]
+	print("\nRunning:", " ".join(bids_cmd))
+	subprocess.run(bids_cmd, check=True) # raises if dcm2bids fails
+	# Remove the tmp folder of this session only; other sessions may be converting next to it (see scheduler).
+	shutil.rmtree(f"{dataPath}/tmp_dcm2bids/sub-{subID:02d}_ses-{sesID:02d}", ignore_errors=True)
+
+	sesPath = f"{dataPath}/sub-{subID:02d}/ses-{sesID:02d}"
+	if not os.path.isdir(sesPath):
+		raise RuntimeError(f"dcm2bids did not create {sesPath} ! :(")
+
+def mprageise_MRI(subID, sesID, homePath):
 
 	# 2. Remove background noise from MP2RAGE UNI image for the first session only.
-	if sesID == 1:
-		anatPath   = f"{dataPath}/sub-{subID:02d}/ses-{sesID:02d}/anat"
-		anatLayout = bids.layout.BIDSLayout(anatPath, validate=False)
+	if sesID != 1:
+		print(f"MP2RAGE was not background-corrected for session {sesID:02d}. Assuming MP2RAGE was collected in ses-01.")
+		return
 
-		INV2_image_conf = grabber.define_grabconf(subID, sesID, "MP2RAGE", "nii.gz", inv=2)
-		UNI_image_conf  = grabber.define_grabconf(subID, sesID, "UNIT1", "nii.gz")
+	dataPath   = f'{homePath}/data_MRI/sourcedata/raw'
+	anatPath   = f"{dataPath}/sub-{subID:02d}/ses-{sesID:02d}/anat"
+	anatLayout = grabber.get_layout(anatPath)
 
-		INV2_image = grabber.grab_BIDS_object(anatPath, anatLayout, INV2_image_conf)[0]
-		UNI_image  = grabber.grab_BIDS_object(anatPath, anatLayout, UNI_image_conf)[0]
+	INV2_image_conf = grabber.define_grabconf(subID, sesID, "MP2RAGE", "nii.gz", inv=2)
+	UNI_image_conf  = grabber.define_grabconf(subID, sesID, "UNIT1", "nii.gz")
 
-		mp2rage_cmd = f'{homePath}/scripts/import/MPRAGEise.py -i {INV2_image.path} -u {UNI_image.path} -o {dataPath}/sub-{subID:02d}/ses-{sesID:02d}/anat'
-		print("\nRunning:", mp2rage_cmd)
-		os.system(mp2rage_cmd)
-		
-		# Create a json file for the unbiased clean T1 image.
-		os.system(f"cp {anatPath}/sub-{subID:02d}_ses-{sesID:02d}_UNIT1.json {anatPath}/sub-{subID:02d}_ses-{sesID:02d}_T1w.json")
+	INV2_image = grabber.grab_BIDS_object(anatPath, anatLayout, INV2_image_conf)[0]
+	UNI_image  = grabber.grab_BIDS_object(anatPath, anatLayout, UNI_image_conf)[0]
 
-	else:
-		print(f"MP2RAGE was not background-corrected for session {sesID:02d}. Assuming MP2RAGE was collected in ses-01.")
+	print(f"\nMPRAGEising {UNI_image.path} with {INV2_image.path}")
+	out_name = MPRAGEise.mprageise(INV2_image.path, UNI_image.path, anatPath, overwrite=True) # raises if it fails
+	print(f"Output file: {out_name}")
+
+	# Create a json file for the unbiased clean T1 image.
+	shutil.copy(f"{anatPath}/sub-{subID:02d}_ses-{sesID:02d}_UNIT1.json", f"{anatPath}/sub-{subID:02d}_ses-{sesID:02d}_T1w.json")
 
 	# 3. Remove background noise from functional images.
 
 if __name__ == "__main__":
+    # An optional last argument runs a single step ('bids' or 'mprageise'), as the import scheduler does.
     subID, sesID, project, homePath = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3], sys.argv[4]
-    import_MRI(subID, sesID, project, homePath)
\ No newline at end of file
+    step = sys.argv[5] if len(sys.argv) > 5 else None
+    if step in (None, 'bids'):
+        import_MRI(subID, sesID, project, homePath)
+    if step in (None, 'mprageise'):
+        mprageise_MRI(subID, sesID, homePath)
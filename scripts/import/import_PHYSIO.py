@@ -2,8 +2,10 @@
 # Time-stamp: <2025-08-07 m.utrosa@bcbl.eu>
 #
 # Prerequisites for python packages:  phys2bids;
-# 									  bioread
-# Prerequisites for matlab toolboxes: Signal Processing;
+# 									  bioread;
+#									  h5py
+# Prerequisites for matlab (only for method='tapas'): MATLAB Engine API for Python (matlabengine);
+#									  Signal Processing;
 #									  Statistics and Machine Learning
 #
 # Manually copy physio data (BIOPAC) from the Physio computer in the MRI room.
@@ -14,51 +16,118 @@
 #	to   /home/<username>/projects/<project_name>/data_phyiso/sourcedata/.
 
 # Import python packages
-import bids, os, sys
+from concurrent.futures import ThreadPoolExecutor
+import queue, subprocess, sys
 
 # Import custom-made functions
 from scripts import grabber
+from . import physio, retroicor
 
-def import_PHYSIO(subID, sesID, project, task, homePath):
+def start_engines(homePath, n_engines=1):
+	"""
+	Start MATLAB engines (in parallel) with scripts/import on their path, to run tapas.m
+	for many sessions without starting MATLAB for every session.
+	"""
+	import matlab.engine
+
+	starting = [matlab.engine.start_matlab("-nodesktop -nosplash", background=True) for _ in range(n_engines)]
+	engines  = [future.result() for future in starting]
+	for engine in engines:
+		engine.addpath(f"{homePath}/scripts/import", nargout=0)
+	return engines
+
+def import_PHYSIO(subID, sesID, project, task, homePath, method='numpy', engine=None):
 
 	# 1. Physio data import
 	physioPath   = f"{homePath}/data_physio/sourcedata/"
-	physioLayout = bids.layout.BIDSLayout(physioPath, validate=False)
+	physioLayout = grabber.get_layout(physioPath)
 	physio_conf  = grabber.define_grabconf(subID, sesID, "physio", "acq")
 	acq_object   = grabber.grab_BIDS_object(physioPath, physioLayout, physio_conf)
-	acq_path 	 = acq_object[0].path # Works if only one BIOPAC datafile is collected per session.
-
-	# 2. Create a temporary folder to store TAPAS-compatible data
-	tmpPath = f"{homePath}/data_physio/raw/tmp/"
-	if not os.path.exists(tmpPath):
-	    os.makedirs(tmpPath)
-
-	# 3. Transform .acq files to .mat and/or .txt
-	acqFile = acq_path.split("sourcedata/")[1]
-	matFile = acqFile.split(".")[0] + ".mat"
-	txtFile = acqFile.split(".")[0] + ".txt"
-
-	print(f"\nRunning:, acq2mat {acq_path} {tmpPath}{matFile}")
-	os.system(f"acq2mat {acq_path} {tmpPath}{matFile}")      # OK, if using matfile to read exported data in MATLAB.
-	# os.system(f"acq2hdf5 {acq_path} {tmpPath}{matFile}")   # Should work with HDF5 read
-	
-	print(f"\nRunning:, acq2txt --outfile={tmpPath}{txtFile} {acq_path}")
-	os.system(f"acq2txt --outfile={tmpPath}{txtFile} {acq_path}")
-
-	# 4. Reorder compatible data
-	reorder_cmd = f"makeBIOPAC_compatible('{homePath}', {subID}, {sesID}, '{task}'); exit;"
-	os.chdir(f"{homePath}/scripts/import")
-	print("\nRunning:", reorder_cmd)
-	os.system(f'matlab -nodesktop -nosplash -r "{reorder_cmd}"')
-
-	# Remove unnecessary temporary folder
-	os.system(f"rm -r {homePath}/data_physio/raw/tmp/")
-
-	# 5. Preprocess compatible data
-	tapas_cmd = f"tapas('{homePath}', {subID}, {sesID}, '{project}', '{task}'); exit;"
-	print("\nRunning:", tapas_cmd)
-	os.system(f'matlab -nodesktop -nosplash -r "{tapas_cmd}"')
+
+	# 2. Convert the .acq files into a compact binary store (HDF5, one float32 dataset per channel)
+	h5_paths = []
+	for split, acq in enumerate(acq_object, start=1):
+		h5_path = physio.store_path(homePath, subID, sesID, task, split if len(acq_object) > 1 else None)
+		print(f"\nConverting {acq.path} to {h5_path}")
+		h5_paths.append(physio.read_acq(acq.path, h5_path))
+
+	# 3. Find the scanner triggers and split the recordings into runs (one per acq- label)
+	mriLayout = grabber.get_layout(f"{homePath}/data_MRI/sourcedata/raw")
+	bolds     = physio.bold_runs(mriLayout, subID, sesID, task)
+	segments  = physio.segment_runs(h5_paths, bolds)
+	physio.save_segments(segments, f"{homePath}/data_physio/raw/sub-{subID:02d}_ses-{sesID:02d}_task-{task}_runs.tsv")
+
+	# 4. Calculate the physio regressors of all runs (RETROICOR)
+	if method == 'numpy':
+		retroicor.session_regressors(segments, homePath, subID, sesID, task)
+
+	# Or with TAPAS PhysIO in MATLAB
+	elif method == 'tapas':
+		# Resample all channels to the physio sampling rate and save the TAPAS-compatible data
+		# tapas.m works if only one BIOPAC datafile is collected per session.
+		physio.make_compatible(h5_paths[0], physio.compatible_path(homePath, subID, sesID, task))
+
+		# Preprocess compatible data, in a running MATLAB engine if given. MATLAB errors are raised here.
+		if engine is not None:
+			print(f"\nRunning: tapas('{homePath}', {subID}, {sesID}, '{project}', '{task}') in the MATLAB engine")
+			engine.tapas(homePath, subID, sesID, project, task, nargout=0)
+		else:
+			tapas_cmd = f"tapas('{homePath}', {subID}, {sesID}, '{project}', '{task}')"
+			print("\nRunning:", tapas_cmd)
+			subprocess.run(["matlab", "-nodesktop", "-nosplash", "-batch", tapas_cmd],
+						   cwd=f"{homePath}/scripts/import", check=True)
+
+	else:
+		raise ValueError(f"Unknown method {method}: use 'numpy' or 'tapas'.")
+
+def import_PHYSIO_batch(pairs, project, task, homePath, method='numpy', n_engines=1):
+	"""
+	Import the physio data of many subjects and sessions. With method='tapas', n_engines
+	MATLAB engines are started once and shared by all sessions (one session per engine at a time).
+
+	Arguments:
+		pairs     (list): [(subID, sesID), ...]
+		n_engines (int) : number of MATLAB engines (sessions processed at the same time)
+
+	Returns:
+		a dictionary {(subID, sesID): exception} of the sessions that failed
+	"""
+	engines = queue.Queue()
+	for engine in (start_engines(homePath, n_engines) if method == 'tapas' else [None] * n_engines):
+		engines.put(engine)
+
+	def run(subID, sesID):
+		engine = engines.get()
+		try:
+			import_PHYSIO(subID, sesID, project, task, homePath, method, engine)
+		finally:
+			engines.put(engine)
+
+	errors = {}
+	try:
+		with ThreadPoolExecutor(max_workers=n_engines) as pool:
+			jobs = {pool.submit(run, subID, sesID): (subID, sesID) for subID, sesID in pairs}
+			for job, (subID, sesID) in jobs.items():
+				if job.exception() is not None:
+					errors[(subID, sesID)] = job.exception()
+					print(f"FAILED physio import for sub-{subID:02d} ses-{sesID:02d}: {job.exception()}")
+	finally:
+		while not engines.empty():
+			engine = engines.get()
+			if engine is not None:
+				engine.quit()
+
+	return errors
 
 if __name__ == "__main__":
-    subID, sesID, project, task, homePath = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5]
-    import_PHYSIO(subID, sesID, project, task, homePath)
\ No newline at end of file
+    # Either: <subID> <sesID> <project> <task> <homePath> [<method>]
+    # or:     --batch <project> <task> <homePath> <method> <n_engines> <sub:ses> [<sub:ses> ...]
+    if sys.argv[1] == "--batch":
+        project, task, homePath, method, n_engines = sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], int(sys.argv[6])
+        pairs  = [tuple(int(i) for i in pair.split(":")) for pair in sys.argv[7:]]
+        errors = import_PHYSIO_batch(pairs, project, task, homePath, method, n_engines)
+        sys.exit(1 if errors else 0)
+    else:
+        subID, sesID, project, task, homePath = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5]
+        method = sys.argv[6] if len(sys.argv) > 6 else 'numpy'
+        import_PHYSIO(subID, sesID, project, task, homePath, method)
@@ -0,0 +1,285 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+#
+# In-process handling of BIOPAC physio recordings (.acq).
+#
+# The recording is read with bioread one channel at a time and written to an
+# HDF5 file with one contiguous float32 dataset per channel (attributes: name,
+# units, samples_per_second). The file can be read by MATLAB (h5read) and the
+# channels can be memory-mapped in Python without loading the whole recording.
+#
+# make_compatible() replaces makeBIOPAC_compatible.m: all channels are resampled
+# to the rate of the physio channels and saved in the BIOPAC .mat format that
+# TAPAS PhysIO reads ('biopac_Mat').
+#
+# segment_runs() finds the scanner volume triggers in the trigger channel,
+# splits them into runs and matches every run to a BIDS bold acquisition
+# (acq- label) by TR and number of volumes.
+
+# Import python packages
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+import os
+import numpy as np
+import bioread, h5py
+import nibabel as nib
+import pandas as pd
+from scipy.io import savemat
+from scipy.signal import resample_poly
+
+# Import custom-made functions
+from scripts import grabber
+
+# Channel names expected by the TAPAS read-in functions
+TAPAS_LABELS = {'pneumatic': 'RSP', 'ppg': 'PPG100C', 'trigger': 'MRTtrigger'}
+
+def store_path(homePath, subID, sesID, task, split=None):
+	"""Path of the HDF5 physio store of a subject and session (split: index of the recording, if several)."""
+	split = f"_split-{split:02d}" if split is not None else ""
+	return f"{homePath}/data_physio/raw/sub-{subID:02d}_ses-{sesID:02d}_task-{task}{split}_physio.h5"
+
+def compatible_path(homePath, subID, sesID, task):
+	"""Path of the TAPAS-compatible physio file of a subject and session."""
+	return f"{homePath}/data_physio/raw/sub-{subID:02d}_ses-{sesID:02d}_task-{task}_compatible.mat"
+
+def read_acq(acq_path, h5_path):
+	"""
+	Convert a BIOPAC .acq file into an HDF5 physio store, channel by channel.
+
+	Arguments:
+		acq_path (str): BIOPAC recording
+		h5_path  (str): output file (datasets channel_00, channel_01, ... in the order of the recording)
+
+	Returns:
+		h5_path
+	"""
+	headers = bioread.read_headers(acq_path)
+
+	os.makedirs(os.path.dirname(h5_path), exist_ok=True)
+	tmp_path = f"{h5_path}.{os.getpid()}"
+	with h5py.File(tmp_path, 'w') as h5:
+		h5.attrs['source'] = os.path.basename(acq_path)
+		for i, header in enumerate(headers.channels):
+			# Only channel i is read from the file, so memory is bounded by the largest channel.
+			channel = bioread.read_file(acq_path, channel_indexes=[i]).channels[i]
+			ds = h5.create_dataset(f"channel_{i:02d}", data=np.asarray(channel.data, dtype=np.float32))
+			ds.attrs['name']  = header.name
+			ds.attrs['units'] = header.units
+			ds.attrs['samples_per_second'] = float(header.samples_per_second)
+			del channel
+	os.replace(tmp_path, h5_path)
+
+	return h5_path
+
+def load_channels(h5_path):
+	"""
+	Open the channels of an HDF5 physio store without reading them.
+
+	Returns:
+		a list of dictionaries with name, units, samples_per_second and data (a read-only memory map)
+	"""
+	channels = []
+	with h5py.File(h5_path, 'r') as h5:
+		for key in sorted(k for k in h5 if k.startswith("channel_")):
+			ds = h5[key]
+			channels.append({'name'              : ds.attrs['name'],
+							 'units'             : ds.attrs['units'],
+							 'samples_per_second': float(ds.attrs['samples_per_second']),
+							 'data'              : np.memmap(h5_path, mode='r', dtype=ds.dtype, shape=ds.shape,
+															 offset=ds.id.get_offset()) if ds.size else np.empty(0, ds.dtype)})
+	return channels
+
+def resample_channels(data, source_rate, target_rate):
+	"""
+	Polyphase resampling (anti-aliasing FIR filter, as MATLAB's resample) of channels
+	sharing one sampling rate. data is (samples x channels); all channels are filtered at once.
+	"""
+	ratio = Fraction(target_rate / source_rate).limit_denominator(1000)
+	if ratio == 1:
+		return np.asarray(data, dtype=np.float64)
+	return resample_poly(np.asarray(data, dtype=np.float64), ratio.numerator, ratio.denominator, axis=0)
+
+def make_compatible(h5_path, out_path, n_threads=4):
+	"""
+	Resample all channels of a physio store to the rate of the physio channels and save
+	them for TAPAS PhysIO (data, isi, isi_units, labels, start_sample, units).
+
+	The first channel is the scanner trigger, usually sampled faster than the physio
+	channels. Channels are grouped by sampling rate, each group is resampled in one pass
+	and the groups are processed in parallel.
+
+	Arguments:
+		h5_path   (str): physio store written by read_acq()
+		out_path  (str): output .mat file
+		n_threads (int): number of groups resampled at the same time
+
+	Returns:
+		out_path
+	"""
+	channels = load_channels(h5_path)
+
+	# The sampling rate of the physio channels (all but the trigger) should be the same.
+	rates = sorted({channel['samples_per_second'] for channel in channels[1:]})
+	targetRate = rates[0]
+	if len(rates) == 1:
+		print(f'All channels (excluding the "{channels[0]["name"]}") have the same sampling rate: {targetRate:.2f}')
+	else:
+		print(f'Warning: Not all physio channels have the same sampling rate. Resampling to {targetRate:.2f}')
+	print(f'Sampling rate of the excluded channel "{channels[0]["name"]}" is {channels[0]["samples_per_second"]:.2f}')
+
+	groups = {}
+	for i, channel in enumerate(channels):
+		groups.setdefault(channel['samples_per_second'], []).append(i)
+
+	def resample_group(rate):
+		n = min(channels[i]['data'].size for i in groups[rate])
+		data = np.column_stack([channels[i]['data'][:n] for i in groups[rate]])
+		return rate, resample_channels(data, rate, targetRate)
+
+	resampled = {}
+	with ThreadPoolExecutor(max_workers=n_threads) as pool:
+		for rate, data in pool.map(resample_group, groups):
+			for column, i in enumerate(groups[rate]):
+				resampled[i] = data[:, column]
+
+	# Truncate all channels (e.g. the trigger) to the length of the physio channels.
+	n_samples = min(resampled[i].size for i in range(1, len(channels))) if len(channels) > 1 else resampled[0].size
+	data = np.column_stack([resampled[i][:n_samples] for i in range(len(channels))])
+
+	# Rename labels as the TAPAS read-in functions expect.
+	labels = []
+	for channel in channels:
+		matches = [label for key, label in TAPAS_LABELS.items() if key in channel['name'].lower()]
+		labels.append(matches[0] if matches else channel['name'])
+
+	savemat(out_path, {'data'        : data,
+					   'isi'         : 1 / targetRate,
+					   'isi_units'   : 's',
+					   'labels'      : np.array(labels, dtype=object),
+					   'start_sample': 0,
+					   'units'       : np.array([channel['units'] for channel in channels], dtype=object)})
+	print(f'Compatible data saved successfully to "{out_path}"')
+
+	return out_path
+
+def detect_triggers(trigger, samples_per_second, threshold=None):
+	"""
+	Onsets (in seconds) of the scanner volume triggers: rising edges of the trigger channel.
+
+	Arguments:
+		trigger            (array): trigger channel
+		samples_per_second (float): sampling rate of the trigger channel
+		threshold          (float): edge threshold; halfway between the minimum and maximum if None
+	"""
+	trigger = np.asarray(trigger)
+	if threshold is None:
+		threshold = (trigger.min() + trigger.max()) / 2
+	high  = trigger >= threshold
+	edges = np.flatnonzero(high[1:] & ~high[:-1]) + 1
+	return edges / samples_per_second
+
+def cluster_runs(onsets, max_gap=5.0, min_triggers=10):
+	"""
+	Split trigger onsets into runs wherever two triggers are more than max_gap seconds apart.
+	Runs with fewer than min_triggers triggers (e.g. test pulses) are dropped.
+
+	Returns:
+		a list of arrays of trigger onsets, one per run
+	"""
+	runs = np.split(onsets, np.flatnonzero(np.diff(onsets) > max_gap) + 1)
+	return [run for run in runs if run.size >= min_triggers]
+
+def bold_runs(mriLayout, subID, sesID, task):
+	"""
+	TR and number of volumes of the bold acquisitions of a session (one row per acq- label).
+	Only the NIfTI headers are read.
+	"""
+	bolds = grabber.grab_BIDS_table(mriLayout, subject=subID, session=sesID, task=task,
+									suffix="bold", extension="nii.gz")
+	if bolds.empty:
+		raise FileNotFoundError(f"No bold files of task {task} found for sub-{subID:02d} ses-{sesID:02d}; "
+								f"run import_MRI first.")
+	rows = []
+	for acq, files in bolds.groupby('acquisition', sort=False):
+		path     = files['path'].iloc[0] # all echoes share TR and volumes
+		metadata = mriLayout.get_metadata(path)
+		rows.append({'acquisition'    : acq,
+					 'TR'             : float(metadata['RepetitionTime']),
+					 'n_vols'         : int(nib.load(path).shape[3]),
+					 'AcquisitionTime': metadata.get('AcquisitionTime', "")})
+	return pd.DataFrame(rows, columns=['acquisition', 'TR', 'n_vols', 'AcquisitionTime']).sort_values('AcquisitionTime')
+
+def match_runs(runs, bolds, tr_tolerance=0.02):
+	"""
+	Match trigger runs to bold acquisitions. A run matches an acquisition if their TRs differ by
+	less than tr_tolerance (relative) and the run has at least as many triggers as the acquisition
+	has volumes; among matches the closest number of volumes wins. Runs are matched in time order.
+
+	Returns:
+		a list with the acquisition label of every run (None if no acquisition matches)
+	"""
+	labels, used = [], set()
+	for run in runs:
+		TR = np.median(np.diff(run))
+		candidates = bolds[(abs(bolds['TR'] - TR) < tr_tolerance * bolds['TR']) & (bolds['n_vols'] <= run.size)
+						   & ~bolds['acquisition'].isin(used)]
+		if candidates.empty:
+			labels.append(None)
+			continue
+		best = candidates.iloc[np.argmin(run.size - candidates['n_vols'].to_numpy())]
+		labels.append(best['acquisition'])
+		used.add(best['acquisition'])
+	return labels
+
+def segment_runs(h5_paths, bolds, max_gap=5.0, tr_tolerance=0.02):
+	"""
+	Segment one or more physio recordings of a session into runs.
+
+	The trigger is the first channel of every recording. Each run is returned with views
+	(slices of the memory-mapped channels, no copies) from its first trigger to one TR after
+	its last trigger.
+
+	Arguments:
+		h5_paths     (list)     : physio stores written by read_acq()
+		bolds        (DataFrame): output of bold_runs()
+		max_gap      (float)    : seconds between triggers that separate two runs
+		tr_tolerance (float)    : relative TR difference accepted when matching runs
+
+	Returns:
+		a list of dictionaries with acquisition, recording, onset, TR, n_triggers, n_vols, triggers
+		(onsets relative to the run start, in seconds) and channels ({name: (samples_per_second, view)})
+	"""
+	segments = []
+	for h5_path in h5_paths:
+		channels = load_channels(h5_path)
+		onsets   = detect_triggers(channels[0]['data'], channels[0]['samples_per_second'])
+		runs     = cluster_runs(onsets, max_gap)
+
+		for run, acq in zip(runs, match_runs(runs, bolds, tr_tolerance)):
+			if acq is None:
+				print(f"No bold acquisition matches the run at {run[0]:.1f} s of {h5_path} "
+					  f"({run.size} triggers, TR {np.median(np.diff(run)):.3f} s).")
+				continue
+			n_vols = int(bolds.loc[bolds['acquisition'] == acq, 'n_vols'].iloc[0])
+			bolds  = bolds[bolds['acquisition'] != acq]
+			TR     = float(np.median(np.diff(run)))
+			start, stop = run[0], run[-1] + TR
+			views = {channel['name']: (channel['samples_per_second'],
+									   channel['data'][int(start * channel['samples_per_second']):
+													   int(np.ceil(stop * channel['samples_per_second']))])
+					 for channel in channels[1:]}
+			segments.append({'acquisition': acq, 'recording': h5_path, 'onset': start, 'TR': TR,
+							 'n_triggers': run.size, 'n_vols': n_vols, 'triggers': run - start, 'channels': views})
+
+	for row in bolds.itertuples():
+		print(f"No physio run found for acq-{row.acquisition} (TR {row.TR} s, {row.n_vols} volumes).")
+
+	return segments
+
+def save_segments(segments, out_path):
+	"""Write the segmentation (one row per run) to a TSV file."""
+	columns = ['acquisition', 'recording', 'onset', 'TR', 'n_triggers', 'n_vols']
+	table = pd.DataFrame([{key: segment[key] for key in columns} for segment in segments], columns=columns)
+	table['recording'] = table['recording'].map(os.path.basename)
+	table.to_csv(out_path, sep='\t', index=False)
+	return out_path
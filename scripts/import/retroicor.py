@@ -0,0 +1,173 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+#
+# Physiological noise regressors in NumPy, replacing TAPAS PhysIO (tapas.m).
+#
+# RETROICOR (Glover et al., 2000): Fourier expansions of the cardiac phase
+# (order 3), the respiratory phase (order 4) and their interaction (order 1),
+# as configured in tapas.m, sampled at the onset of every volume (the scanner
+# triggers, see physio.segment_runs). Optionally, heart rate variability
+# (Chang et al., 2009) and respiratory volume per time (Birn et al., 2008)
+# convolved with their response functions.
+#
+# Each run is computed from its own segment of the recording (the zero-copy
+# channel views of physio.segment_runs), so only the samples of the run are
+# read. The regressors are written as TAPAS writes them
+# (sub-XX_ses-XX_task-X_acq-Y_regressors.tsv in data_physio/raw, tab-separated,
+# no header), which is what artifacts.filter_artifacts reads.
+
+# Import python packages
+import os
+import numpy as np
+from scipy.signal import butter, find_peaks, hilbert, sosfiltfilt
+
+def find_channel(channels, key):
+	"""The channel whose name contains key (e.g. 'ppg', 'pneumatic'), as in physio.TAPAS_LABELS."""
+	matches = [channel for channel in channels if key in channel['name'].lower()]
+	if not matches:
+		raise ValueError(f"No channel named *{key}* in {[channel['name'] for channel in channels]}")
+	return matches[0]
+
+def cardiac_peaks(ppg, fs, min_interval=0.4):
+	"""
+	Times (s) of the cardiac pulses in a PPU/PPG signal, at least min_interval seconds apart.
+	"""
+	ppg = np.asarray(ppg, dtype=np.float64)
+	peaks, _ = find_peaks(ppg, distance=max(1, int(min_interval * fs)), prominence=0.5 * ppg.std())
+	return peaks / fs
+
+def cardiac_phase(peaks, times):
+	"""
+	Cardiac phase at the given times: rises linearly from 0 to 2*pi between two pulses.
+	Times before the first or after the last pulse get phase 0.
+	"""
+	if peaks.size < 2:
+		return np.zeros(times.size)
+	index = np.searchsorted(peaks, times, side='right') - 1
+	valid = (index >= 0) & (index < peaks.size - 1)
+	index = np.clip(index, 0, peaks.size - 2)
+	phase = 2 * np.pi * (times - peaks[index]) / (peaks[index + 1] - peaks[index])
+	return np.where(valid, phase, 0)
+
+def filter_respiration(resp, fs, passband=(0.01, 2.0)):
+	"""Band-pass filtered respiratory signal (passband as in tapas.m)."""
+	sos = butter(2, passband, btype='bandpass', fs=fs, output='sos')
+	return sosfiltfilt(sos, np.asarray(resp, dtype=np.float64))
+
+def respiratory_phase(resp, fs, times, n_bins=100):
+	"""
+	Respiratory phase at the given times by histogram equalization (Glover et al., 2000):
+	pi times the fraction of samples below the current amplitude, signed by the direction
+	of breathing (inhalation > 0, exhalation < 0).
+
+	Arguments:
+		resp  (array): filtered respiratory signal
+		fs    (float): sampling rate
+		times (array): sample times (s)
+	"""
+	counts, edges = np.histogram(resp, bins=n_bins)
+	cumulative    = np.cumsum(counts) / resp.size
+
+	samples = np.clip(np.round(times * fs).astype(int), 0, resp.size - 1)
+	bins    = np.clip(np.digitize(resp[samples], edges) - 1, 0, n_bins - 1)
+	return np.pi * cumulative[bins] * np.sign(np.gradient(resp)[samples])
+
+def fourier(phase, order):
+	"""cos(m * phase), sin(m * phase) for m = 1 .. order (volumes x 2 * order)."""
+	m = np.outer(phase, np.arange(1, order + 1))
+	return np.stack([np.cos(m), np.sin(m)], axis=2).reshape(phase.size, 2 * order)
+
+def interaction(c_phase, r_phase, order):
+	"""Cardiac-respiratory interaction terms: cos/sin(j * c +- k * r), j, k = 1 .. order."""
+	columns = []
+	for j in range(1, order + 1):
+		for k in range(1, order + 1):
+			for sign in (1, -1):
+				columns += [np.cos(j * c_phase + sign * k * r_phase), np.sin(j * c_phase + sign * k * r_phase)]
+	return np.column_stack(columns) if columns else np.empty((c_phase.size, 0))
+
+def crf(t):
+	"""Cardiac response function (Chang et al., 2009)."""
+	return 0.6 * t ** 2.7 * np.exp(-t / 1.6) - 16 / np.sqrt(2 * np.pi * 9) * np.exp(-(t - 12) ** 2 / 18)
+
+def rrf(t):
+	"""Respiratory response function (Birn et al., 2008)."""
+	return 0.6 * t ** 2.1 * np.exp(-t / 1.6) - 0.0023 * t ** 3.54 * np.exp(-t / 4.25)
+
+def convolve_at(signal_times, signal, response, times, dt=0.1):
+	"""Resample a signal on a regular grid (dt), convolve it with a response function and sample it at times."""
+	grid   = np.arange(signal_times[0], signal_times[-1], dt)
+	kernel = response(np.arange(0, 32, dt))
+	values = np.interp(grid, signal_times, signal)
+	values = np.convolve(values - values.mean(), kernel / np.abs(kernel).sum())[:grid.size]
+	return np.interp(times, grid, values)
+
+def recording_regressors(channels, times, order_c=3, order_r=4, order_cr=1, hrv=False, rvt=False):
+	"""
+	Regressors of one recording or run segment at the given volume onsets.
+
+	Arguments:
+		channels (list) : channels with name, samples_per_second and data (physio.load_channels, segment_channels)
+		times    (array): volume onsets (s, from the start of the channels)
+		order_c  (int)  : order of the cardiac Fourier expansion
+		order_r  (int)  : order of the respiratory Fourier expansion
+		order_cr (int)  : order of the cardiac-respiratory interaction
+		hrv      (bool) : add heart rate variability convolved with the CRF
+		rvt      (bool) : add respiratory volume per time convolved with the RRF
+
+	Returns:
+		an array (volumes x regressors)
+	"""
+	ppg  = find_channel(channels, 'ppg')
+	resp = find_channel(channels, 'pneumatic')
+
+	peaks   = cardiac_peaks(ppg['data'], ppg['samples_per_second'])
+	c_phase = cardiac_phase(peaks, times)
+
+	resp_fs = resp['samples_per_second']
+	resp_filtered = filter_respiration(resp['data'], resp_fs)
+	r_phase = respiratory_phase(resp_filtered, resp_fs, times)
+
+	columns = [fourier(c_phase, order_c), fourier(r_phase, order_r), interaction(c_phase, r_phase, order_cr)]
+
+	if hrv:
+		rate = 60 / np.diff(peaks)
+		columns.append(convolve_at((peaks[1:] + peaks[:-1]) / 2, rate, crf, times)[:, None])
+	if rvt:
+		analytic  = hilbert(resp_filtered)
+		frequency = np.gradient(np.unwrap(np.angle(analytic))) * resp_fs / (2 * np.pi)
+		volume    = 2 * np.abs(analytic) * frequency
+		columns.append(convolve_at(np.arange(resp_filtered.size) / resp_fs, volume, rrf, times)[:, None])
+
+	return np.column_stack(columns)
+
+def segment_channels(segment):
+	"""The channel views of a run (physio.segment_runs) as channels for recording_regressors."""
+	return [{'name': name, 'samples_per_second': samples_per_second, 'data': view}
+			for name, (samples_per_second, view) in segment['channels'].items()]
+
+def session_regressors(segments, homePath, subID, sesID, task, **options):
+	"""
+	Compute and save the regressors of all runs of a session.
+
+	Arguments:
+		segments (list): runs found by physio.segment_runs()
+		**options      : orders and optional HRV/RVT regressors (see recording_regressors)
+
+	Returns:
+		the paths of the regressor files, one per run
+	"""
+	paths = []
+	for segment in segments:
+		# Volume onsets: the last n_vols triggers of the run (TAPAS align_scan = 'last'),
+		# relative to the run start like the channel views.
+		times  = segment['triggers'][-segment['n_vols']:]
+		values = recording_regressors(segment_channels(segment), times, **options)
+
+		path = (f"{homePath}/data_physio/raw/sub-{subID:02d}_ses-{sesID:02d}_task-{task}_"
+				f"acq-{segment['acquisition']}_regressors.tsv")
+		np.savetxt(path, values, delimiter='\t', fmt='%.8g')
+		paths.append(path)
+		print(f"Saved {values.shape[1]} physio regressors for acq-{segment['acquisition']}: {os.path.basename(path)}")
+
+	return paths
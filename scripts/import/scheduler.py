@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# Time-stamp: <2025-18-09 m.utrosa@bcbl.eu>
+#
+# Import many subjects and sessions concurrently.
+#
+# For every (subject, session) pair the import stages are:
+#	mri       : import_MRI (BIDS conversion)
+#	mprageise : import_MRI (background correction of the MP2RAGE UNI image, ses-01 only, after mri)
+#	log       : import_LOG (copies logfiles into the BIDS func folder, so after mri)
+#	physio    : import_PHYSIO (matches physio runs to the BIDS bold files, so after mri)
+# Independent stages run in parallel with a bounded number of workers. Each stage
+# runs in its own process and its output is saved in logs/import. A stage that exits
+# without error leaves a .done file there, so a rerun resumes where the previous one stopped.
+#
+# Usage:
+#	python -m scripts.import.scheduler <project> <task> <homePath> <n_workers> <sub:ses> [<sub:ses> ...]
+#	python -m scripts.import.scheduler SUBCORT_HIGHRES localizer /path/to/localizer_fMRI 4 3:1 3:2 4:1
+
+# Import python packages
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import os, subprocess, sys, time
+
+# Stages and the stages they depend on (within the same subject and session)
+STAGES = {'mri'      : [],
+		  'mprageise': ['mri'],
+		  'log'      : ['mri'],
+		  'physio'   : ['mri']}
+
+# Stages that only run for some sessions
+SESSIONS = {'mprageise': [1]}
+
+def stage_command(stage, subID, sesID, project, task, homePath):
+	"""Command line of one import stage."""
+	if stage == 'mri':
+		args = ["scripts.import.import_MRI", subID, sesID, project, homePath, "bids"]
+	elif stage == 'mprageise':
+		args = ["scripts.import.import_MRI", subID, sesID, project, homePath, "mprageise"]
+	elif stage == 'log':
+		args = ["scripts.import.import_LOG", subID, sesID, project, homePath]
+	else:
+		args = ["scripts.import.import_PHYSIO", subID, sesID, project, task, homePath]
+	return [sys.executable, "-m"] + [str(a) for a in args]
+
+def run_stage(stage, subID, sesID, project, task, homePath, logPath):
+	"""Run one stage, write its output to a log file and mark it as done if it succeeded."""
+	name = f"sub-{subID:02d}_ses-{sesID:02d}_{stage}"
+	start = time.time()
+	with open(f"{logPath}/{name}.log", 'w') as log:
+		result = subprocess.run(stage_command(stage, subID, sesID, project, task, homePath),
+								cwd=homePath, stdout=log, stderr=subprocess.STDOUT)
+	if result.returncode == 0:
+		open(f"{logPath}/{name}.done", 'w').close()
+	return result.returncode, time.time() - start
+
+def import_sessions(pairs, project, task, homePath, n_workers=4, force=False):
+	"""
+	Import (subject, session) pairs concurrently, respecting the stage dependencies.
+
+	Arguments:
+		pairs     (list): [(subID, sesID), ...]
+		project   (str) : 'SUBCORT_HIGHRES'
+		task      (str) : 'localizer'
+		homePath  (str) : project folder
+		n_workers (int) : maximum number of stages running at the same time
+		force     (bool): rerun stages that are already done
+
+	Returns:
+		a dictionary {(subID, sesID, stage): 'done' | 'skipped' | 'failed' | 'blocked'}
+	"""
+	logPath = f"{homePath}/logs/import"
+	os.makedirs(logPath, exist_ok=True)
+
+	status = {}
+	for subID, sesID in pairs:
+		for stage in STAGES:
+			done = os.path.exists(f"{logPath}/sub-{subID:02d}_ses-{sesID:02d}_{stage}.done")
+			if stage in SESSIONS and sesID not in SESSIONS[stage]:
+				status[(subID, sesID, stage)] = 'skipped'
+			else:
+				status[(subID, sesID, stage)] = 'skipped' if done and not force else 'pending'
+
+	running = {}
+	with ThreadPoolExecutor(max_workers=n_workers) as pool:
+		while True:
+			# Submit every pending stage whose dependencies are finished; block the ones that cannot run.
+			for (subID, sesID, stage), state in status.items():
+				if state != 'pending':
+					continue
+				deps = [status[(subID, sesID, dep)] for dep in STAGES[stage]]
+				if any(dep in ('failed', 'blocked') for dep in deps):
+					status[(subID, sesID, stage)] = 'blocked'
+					print(f"Not running {stage} for sub-{subID:02d} ses-{sesID:02d}: a previous stage failed.")
+				elif all(dep in ('done', 'skipped') for dep in deps):
+					status[(subID, sesID, stage)] = 'running'
+					running[pool.submit(run_stage, stage, subID, sesID, project, task, homePath, logPath)] = (subID, sesID, stage)
+					print(f"Started {stage} for sub-{subID:02d} ses-{sesID:02d}")
+
+			if not running:
+				break
+
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for job in finished:
+				subID, sesID, stage = running.pop(job)
+				returncode, seconds = job.result()
+				status[(subID, sesID, stage)] = 'done' if returncode == 0 else 'failed'
+				print(f"{'Completed' if returncode == 0 else 'FAILED'} {stage} for sub-{subID:02d} ses-{sesID:02d} "
+					  f"in {seconds:.0f} s (log: {logPath}/sub-{subID:02d}_ses-{sesID:02d}_{stage}.log)")
+
+	return status
+
+if __name__ == "__main__":
+	project, task, homePath, n_workers = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+	pairs  = [tuple(int(i) for i in pair.split(":")) for pair in sys.argv[5:]]
+	status = import_sessions(pairs, project, task, homePath, n_workers)
+	sys.exit(1 if any(state in ('failed', 'blocked') for state in status.values()) else 0)